@@ -0,0 +1,100 @@
+import argparse
+import os
+import shutil
+import sys
+from datetime import datetime
+from main import DataManager, Journal, JournaledBackend, StorageError
+
+# ==========================================
+# 💾 备份与恢复: 变更日志 + 压缩快照 (<数据文件>.history/)
+# ==========================================
+def parse_time(s):
+    # "2026-10-17", "2026-10-17 12:30" 或 "2026-10-17T12:30:05"
+    t = datetime.fromisoformat(s)
+    return t.replace(hour=23, minute=59, second=59) if len(s) == 10 else t
+
+def cmd_list(journal, args):
+    snaps, segs = journal.snapshots(), journal.segments()
+    print("快照:")
+    for seq, ts, f in snaps: print(f"  #{seq:<8} {ts}  {os.path.getsize(journal._file(f)) / 1024:8.1f} KB")
+    total = sum(os.path.getsize(journal._file(f)) for _, f in segs)
+    last = journal._tail()[1]
+    print(f"日志: {len(segs)} 段, {total / 1024:.1f} KB, 最后序号 #{last}, 距上个快照 {last - (snaps[-1][0] if snaps else 0)} 条")
+    if snaps: print(f"可恢复范围: {snaps[0][1]} 之后")
+
+def cmd_history(journal, args):
+    # 某个用户的变更记录 (找误删经期日期前的时间点)
+    for r in journal.records():
+        if r.get("user") != args.user and r["op"] != "all": continue
+        meta = r.get("meta") or r.get("record") or {}
+        dates = meta.get("cycle_data", {}).get("dates")
+        desc = {"create": "注册", "cred": "改密码", "all": "整体替换"}.get(r["op"]) or (f"日志 {', '.join(sorted(r['logs']))}" if r["logs"] else "资料")
+        print(f"  #{r['seq']:<8} {r['ts']}  {desc}" + (f"  经期日期 {len(dates)} 个" if dates is not None else ""))
+
+def cmd_snapshot(journal, args):
+    print(f"快照 #{journal.snapshot(args.backend_obj, args.keep)}")
+
+def cmd_restore(journal, args):
+    at = parse_time(args.at) if args.at else None
+    data, seq = journal.state_at(at, args.seq)
+    backend = args.backend_obj
+    if args.user:
+        rec = data["users"].get(args.user)
+        if rec is None: sys.exit(f"该时间点没有用户 {args.user}")
+        print(f"{args.user}: 恢复到 #{seq}, 经期日期 {len(rec['cycle_data'].get('dates', []))} 个, 日志 {len(rec['cycle_data'].get('logs', {}))} 天")
+        if args.dry_run: return
+        # 只替换这个用户: 元数据整体恢复 (rev 前进一位, 打开的会话会重新加载), 当时的日志写回, 之后新写的日志保留
+        cur = backend.get_meta(args.user) or {}
+        meta = Journal.strip(rec); meta.pop("password", None)
+        meta["rev"] = cur.get("rev", 0) + 1
+        backend.save_logs(args.user, rec["cycle_data"].get("logs", {}), meta, cur.get("rev", 0) if cur else None)
+        return
+    print(f"恢复到 #{seq}: {len(data['users'])} 个用户")
+    if args.dry_run: return
+    # rev 只能前进: 报告/趋势图缓存按 (用户, rev) 命中, 回退的 rev 会被后续写入重用, 运行中的应用就会返回恢复前的结果
+    live = {u: m.get("rev", 0) for u, m in backend.iter_meta()}
+    for u, rec in data["users"].items(): rec["rev"] = max(live.get(u, 0), rec.get("rev", 0)) + 1
+    backend.save_all(data)
+
+def cmd_verify(journal, args):
+    # 重放到最新, 与当前存储逐用户比较 (忽略可重建的派生字段和 rev: worker 刷新快照时 rev 会变但不记日志)
+    data, seq = journal.state_at()
+    live = args.backend_obj.load_all()["users"]
+    norm = lambda rec: {k: v for k, v in Journal.strip(rec).items() if k != "rev"}
+    bad = [u for u in set(live) | set(data["users"]) if norm(live.get(u, {})) != norm(data["users"].get(u, {}))]
+    print(f"重放到 #{seq}: {len(data['users'])} 个用户, 不一致 {len(bad)} 个" + (f": {', '.join(sorted(bad)[:10])}" if bad else ""))
+    if bad: sys.exit(1)
+
+def cmd_sync(journal, args):
+    # 增量异地备份: 只复制目标目录里没有或大小不同的文件 (日志段只追加, 快照不可变)
+    os.makedirs(args.dest, exist_ok=True)
+    copied = 0
+    for f in sorted(os.listdir(journal.path)):
+        if not (f.endswith(".jsonl") or f.endswith(".json.gz")): continue
+        src, dst = journal._file(f), os.path.join(args.dest, f)
+        if os.path.exists(dst) and os.path.getsize(dst) == os.path.getsize(src): continue
+        shutil.copy2(src, dst + ".tmp"); os.replace(dst + ".tmp", dst)
+        copied += os.path.getsize(dst)
+    print(f"已同步到 {args.dest}, 复制 {copied / 1024:.1f} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleHealth 备份与按时间点恢复")
+    parser.add_argument("--backend", choices=["sqlite", "json"], help="默认取 CYCLE_STORAGE")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="快照与日志概况")
+    p = sub.add_parser("history", help="某个用户的变更记录"); p.add_argument("user")
+    p = sub.add_parser("snapshot", help="立即写快照并清理旧日志"); p.add_argument("--keep", type=int, default=Journal.KEEP_SNAPSHOTS)
+    p = sub.add_parser("restore", help="恢复到某个时间点或序号")
+    p.add_argument("--at", help="时间, 如 2026-10-17 12:30"); p.add_argument("--seq", type=int, help="记录序号 (见 history)")
+    p.add_argument("--user", help="只恢复这个用户"); p.add_argument("--dry-run", action="store_true")
+    sub.add_parser("verify", help="重放日志并与当前数据比较")
+    p = sub.add_parser("sync", help="增量复制到备份目录"); p.add_argument("dest")
+    args = parser.parse_args()
+    backend = DataManager.create_backend(args.backend)
+    if not isinstance(backend, JournaledBackend): sys.exit("变更日志未启用 (CYCLE_JOURNAL=0)")
+    args.backend_obj = backend
+    try: globals()[f"cmd_{args.cmd}"](backend.journal, args)
+    except StorageError as e: sys.exit(str(e))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+import argparse
+import bisect
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from datetime import date, datetime, timedelta
+import numpy as np
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from main import (DataManager, SQLiteBackend, JsonFileBackend, MedicalEngine, CycleStats, CyclePredictor, AuthSystem,
+                  AnalyticsEngine, CalendarGenerator, ReportGenerator, TrendSeries, RuleEngine, RemoteBackend, SearchIndex, UserCache, LogCodec, new_user_record)
+
+# ==========================================
+# 🧪 合成数据
+# ==========================================
+class SyntheticDataGenerator:
+    # 可复现的合成用户: 每人有自己的平均周期/波动, 情绪和症状按所处阶段抽样
+    PHASE_MOODS = {
+        "menstrual": ["疲惫", "痛", "悲伤", "平静", "想哭"],
+        "follicular": ["开心", "自信", "能量满格", "高效", "平静"],
+        "ovulatory": ["自信", "被爱", "开心", "能量满格", "感恩"],
+        "luteal": ["焦虑", "易怒", "嘴馋", "浮肿", "内耗", "脑雾"],
+    }
+    PHASE_SYMPTOMS = {
+        "menstrual": ["痛经 (Cramps)", "腰酸背痛", "头痛 (Headache)", "嗜睡"],
+        "follicular": ["长痘 (Acne)"],
+        "ovulatory": ["乳房胀痛 (Breast Pain)", "白带异常"],
+        "luteal": ["腹胀/水肿 (Bloating)", "食欲大增", "失眠", "乳房胀痛 (Breast Pain)", "便秘"],
+    }
+
+    PASSWORD_HASH = "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"  # sha256("test")
+
+    def __init__(self, seed=42): self.rng = random.Random(seed)
+
+    def user(self, years=1, end=None, log_ratio=0.9):
+        rng = self.rng
+        end = end or date.today()
+        start = end - timedelta(days=int(365 * years))
+        mean_len, sd = rng.randint(25, 33), rng.uniform(0.8, 4.0)
+        dates, d = [], start + timedelta(days=rng.randint(0, 20))
+        while d <= end:
+            dates.append(d.isoformat())
+            d += timedelta(days=max(16, int(rng.gauss(mean_len, sd))))
+        moods, habits = list(MedicalEngine.EMOJI_MAP)[:-1], MedicalEngine.HABITS_OPTIONS[1:]
+        logs, ords = {}, [date.fromisoformat(x).toordinal() for x in dates]
+        for i in range((end - start).days + 1):
+            day = start + timedelta(days=i)
+            if rng.random() > log_ratio: continue
+            k = max((j for j, o in enumerate(ords) if o <= day.toordinal()), default=None)
+            cycle_day = day.toordinal() - ords[k] + 1 if k is not None else 1
+            phase = MedicalEngine.determine_phases([cycle_day], mean_len)[0] or "follicular"
+            logs[day.isoformat()] = {
+                "primary_mood": rng.choice(self.PHASE_MOODS[phase]),
+                "secondary_moods": rng.sample(moods, rng.randint(0, 2)),
+                "energy": max(0, min(100, int(rng.gauss(35 if phase == "menstrual" else 65, 15)))),
+                "symptoms": rng.sample(self.PHASE_SYMPTOMS[phase], rng.randint(0, min(2, len(self.PHASE_SYMPTOMS[phase])))),
+                "meds": rng.sample(habits, rng.randint(0, 3)),
+                "note": rng.choice(["", "", "今天有点累", "和朋友吃了火锅", "头痛，早点睡", "跑步 5 公里"]),
+                "phase": phase,
+            }
+        rec = new_user_record(self.PASSWORD_HASH)
+        rec["profile"]["age"] = rng.randint(18, 45)
+        rec["cycle_data"] = {"dates": dates, "logs": logs}
+        rec["cycle_stats"] = CycleStats.from_dates(dates).to_dict()
+        rec["rollups"], rec["rollups_ver"] = AnalyticsEngine.rebuild(logs, dates), AnalyticsEngine.VERSION
+        return rec
+
+    def users(self, n, years=1, prefix="user"):
+        for i in range(n): yield f"{prefix}{i:06d}", self.user(years)
+
+    def populate(self, backend, n, years=1):
+        for u, rec in self.users(n, years): backend.create_user(u, rec)
+
+# ==========================================
+# ⏱️ 基准测试
+# ==========================================
+def legacy_avg(dates):
+    # main_app_ui 旧版的平均周期算法, 作为对照
+    ds = sorted([datetime.strptime(d, "%Y-%m-%d").date() for d in dates])
+    diffs = [(ds[i+1] - ds[i]).days for i in range(len(ds) - 1)]
+    valid = [d for d in diffs if 15 < d < 60]
+    return int(np.mean(valid)) if valid else 28
+
+def measure(fn, repeat):
+    # 计时和内存分开测: tracemalloc 本身会显著拖慢计时
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); samples.append((time.perf_counter() - t) * 1000)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    samples.sort()
+    pct = lambda p: samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+    return {"n": repeat, "mean_ms": statistics.fmean(samples), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99), "peak_kb": peak / 1024}
+
+def make_backend(kind, workdir):
+    if kind == "json": return JsonFileBackend(os.path.join(workdir, "bench.json"))
+    return SQLiteBackend(os.path.join(workdir, "bench.db"))
+
+def run_suite(n_users, years, kind, repeat, seed=42):
+    with tempfile.TemporaryDirectory() as workdir:
+        backend = make_backend(kind, workdir)
+        t = time.perf_counter()
+        SyntheticDataGenerator(seed).populate(backend, n_users, years)
+        populate_s = time.perf_counter() - t
+        DataManager.use(backend)
+        rng = random.Random(seed)
+        names = backend.usernames()
+        pick = lambda: rng.choice(names)
+        sample = backend.get_user(pick())
+        dates, logs = sample["cycle_data"]["dates"], sample["cycle_data"]["logs"]
+        avg = CycleStats.for_user(sample).avg_len()
+        today = date.today().isoformat()
+        entry = {"primary_mood": "开心", "secondary_moods": [], "energy": 60, "symptoms": [], "meds": [], "note": "", "phase": "follicular"}
+        search = SearchIndex(logs)
+        results = {
+            "load_user": measure(lambda: DataManager.load_user(pick()), repeat),
+            "load_meta": measure(lambda: DataManager.load_meta(pick()), repeat),
+            "save_log": measure(lambda: DataManager.save_log(pick(), today, entry), repeat),
+            "stats_incremental": measure(lambda: CycleStats.for_user(sample).avg_len(), repeat),
+            "stats_legacy": measure(lambda: legacy_avg(dates), repeat),
+            "calendar": measure(lambda: CalendarGenerator.generate_compact_html(2025, 6, logs, dates, avg), repeat),
+            "report": measure(lambda: ReportGenerator.generate_html_report("bench", sample, avg), repeat),
+            "rules_batch": measure(lambda: RuleEngine.batch(logs), repeat),
+            "search_build": measure(lambda: SearchIndex(logs), max(1, repeat // 10)),
+            "search_query": measure(lambda: search.days(search.query("头痛 OR 开心 -熬夜 from:2020"), 30), repeat),
+            "trends": measure(lambda: (TrendSeries.energy_by_cycle_day(sample["rollups"]), TrendSeries.symptom_by_phase(sample["rollups"]),
+                                       TrendSeries.mood_by_month(sample["rollups"])), repeat),
+            "predict_all": measure(lambda: CyclePredictor.predict_all(), max(1, repeat // 10)),
+        }
+        DataManager.use(None)
+        return {"users": n_users, "years": years, "backend": kind, "populate_s": populate_s, "results": results}
+
+def print_report(run):
+    print(f"\n== {run['users']} 用户 x {run['years']} 年 ({run['backend']}), 生成数据 {run['populate_s']:.1f}s ==")
+    print(f"{'操作':<20}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'peak KB':>12}")
+    for name, r in run["results"].items():
+        print(f"{name:<20}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['peak_kb']:>12.1f}")
+
+def compare(runs, baseline, tolerance):
+    # 与基线比较 p95, 超过 tolerance 倍视为回归
+    base = {(b["users"], b["backend"]): b["results"] for b in baseline}
+    failed = []
+    for run in runs:
+        for name, r in run["results"].items():
+            old = base.get((run["users"], run["backend"]), {}).get(name)
+            if old and r["p95_ms"] > old["p95_ms"] * tolerance and r["p95_ms"] - old["p95_ms"] > 0.05:
+                failed.append(f"{run['users']} 用户 {name}: p95 {old['p95_ms']:.3f} -> {r['p95_ms']:.3f} ms")
+    return failed
+
+def cmd_suite(args):
+    runs = []
+    for n in args.users:
+        run = run_suite(n, args.years, args.backend, args.repeat, args.seed)
+        print_report(run); runs.append(run)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: json.dump(runs, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f: failed = compare(runs, json.load(f), args.tolerance)
+        for line in failed: print(f"⚠️ 回归: {line}")
+        if failed: sys.exit(1)
+
+# ==========================================
+# 🗜️ 内存对比
+# ==========================================
+class CompactLogs:
+    # 一个用户的日志按列存入 array: 日序数/情绪编码/次要情绪、症状、习惯列表/能量/阶段; 备注稀疏存储并 intern
+    # 列表按原顺序打包成整数 (保留顺序和重复); 缺字段、旧格式 (如 moods/flow/bbt) 或装不下的条目原样放在 extras 里, to_logs 与原 JSON 完全一致
+    # 评估用: 应用和数据服务仍缓存 dict (命中时转回 JSON 的开销与序列化相当), 这里只用于内存对比
+    NO_ENERGY = 255
+    REQUIRED = {"primary_mood", "secondary_moods", "energy", "symptoms", "meds"}
+    SLOT_BITS, MAX_ITEMS = 7, 9   # 每项占 7 位 (词表下标 + 1, 0 表示结束), 64 位里最多 9 项
+
+    def __init__(self):
+        self.ords = array("i")
+        self.primary = array("b")     # -1 表示 "无"
+        self.moods = array("Q")
+        self.symptoms = array("Q")
+        self.habits = array("Q")
+        self.energy = array("B")
+        self.phase = array("b")       # -1 表示未记录
+        self.notes = {}
+        self.extras = {}
+
+    @classmethod
+    def pack(cls, values, index):
+        # 按原顺序打包, 词表之外的值或项数太多返回 None
+        if not isinstance(values, list) or len(values) > cls.MAX_ITEMS: return None
+        code = 0
+        for v in reversed(values):
+            i = index.get(v)
+            if i is None or i + 1 >= 1 << cls.SLOT_BITS: return None
+            code = code << cls.SLOT_BITS | (i + 1)
+        return code
+
+    @classmethod
+    def unpack(cls, code, vocab):
+        out, mask = [], (1 << cls.SLOT_BITS) - 1
+        while code: out.append(vocab[(code & mask) - 1]); code >>= cls.SLOT_BITS
+        return out
+
+    @classmethod
+    def encode(cls, entry):
+        # 返回 (primary, moods, symptoms, habits, energy, phase, note), 无法无损编码时返回 None
+        c = LogCodec
+        if not cls.REQUIRED <= set(entry) <= c.KEYS: return None
+        p = entry["primary_mood"]
+        primary = -1 if p == "无" else c.MOOD_IDX.get(p)
+        moods = cls.pack(entry["secondary_moods"], c.MOOD_IDX)
+        symptoms = cls.pack(entry["symptoms"], c.SYMPTOM_IDX)
+        habits = cls.pack(entry["meds"], c.HABIT_IDX)
+        energy = entry["energy"]
+        phase = c.PHASE_IDX.get(entry["phase"]) if "phase" in entry else -1
+        if None in (primary, moods, symptoms, habits, phase) or not (energy is None or (type(energy) is int and 0 <= energy <= 100)): return None
+        return primary, moods, symptoms, habits, CompactLogs.NO_ENERGY if energy is None else energy, phase, entry.get("note")
+
+    @classmethod
+    def from_logs(cls, logs):
+        out = cls()
+        for day in sorted(logs): out.put(day, logs[day])
+        return out
+
+    def put(self, day, entry):
+        o = date.fromisoformat(day).toordinal()
+        i = bisect.bisect_left(self.ords, o)
+        exists = i < len(self.ords) and self.ords[i] == o
+        code = self.encode(entry)
+        if code is None:
+            if exists: self._delete(i)
+            self.notes.pop(o, None)
+            self.extras[day] = entry
+            return
+        self.extras.pop(day, None)
+        primary, moods, symptoms, habits, energy, phase, note = code
+        cols = (self.primary, self.moods, self.symptoms, self.habits, self.energy, self.phase)
+        if exists:
+            for col, v in zip(cols, code[:6]): col[i] = v
+        else:
+            self.ords.insert(i, o)
+            for col, v in zip(cols, code[:6]): col.insert(i, v)
+        # note 键是否存在也要保留: None 表示条目里没有 note
+        if note is None: self.notes[o] = None
+        elif note: self.notes[o] = sys.intern(note)
+        else: self.notes.pop(o, None)
+
+    def _delete(self, i):
+        for col in (self.ords, self.primary, self.moods, self.symptoms, self.habits, self.energy, self.phase): del col[i]
+
+    def decode(self, i):
+        c = LogCodec
+        o = self.ords[i]
+        entry = {"primary_mood": "无" if self.primary[i] < 0 else c.MOODS[self.primary[i]],
+                 "secondary_moods": self.unpack(self.moods[i], c.MOODS),
+                 "energy": None if self.energy[i] == self.NO_ENERGY else self.energy[i],
+                 "symptoms": self.unpack(self.symptoms[i], c.SYMPTOMS),
+                 "meds": self.unpack(self.habits[i], c.HABITS)}
+        note = self.notes.get(o, "")
+        if note is not None: entry["note"] = note
+        if self.phase[i] >= 0: entry["phase"] = c.PHASES[self.phase[i]]
+        return entry
+
+    def get(self, day, default=None):
+        if day in self.extras: return self.extras[day]
+        o = date.fromisoformat(day).toordinal()
+        i = bisect.bisect_left(self.ords, o)
+        return self.decode(i) if i < len(self.ords) and self.ords[i] == o else default
+
+    def to_logs(self):
+        logs = {date.fromordinal(o).isoformat(): self.decode(i) for i, o in enumerate(self.ords)}
+        logs.update(self.extras)
+        return logs
+
+    def __len__(self): return len(self.ords) + len(self.extras)
+
+    def nbytes(self):
+        # 列数组本身的字节数 (不含 notes/extras)
+        return sum(a.itemsize * len(a) for a in (self.ords, self.primary, self.moods, self.symptoms, self.habits, self.energy, self.phase))
+
+def _traced(build):
+    tracemalloc.start()
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+def cmd_memory(args):
+    # 同一批日志分别以 JSON 解析出的 dict 和 CompactLogs 驻留内存, 比较 tracemalloc 统计的占用
+    gen = SyntheticDataGenerator(args.seed)
+    payloads = [json.dumps(rec["cycle_data"]["logs"], ensure_ascii=False) for _, rec in gen.users(args.users, args.years)]
+    dicts, dict_bytes = _traced(lambda: [json.loads(p) for p in payloads])
+    days = sum(len(d) for d in dicts)
+    # 直接从 JSON 构建, 中间 dict 随即释放, 被 intern 的备注字符串计入 CompactLogs
+    compact, compact_bytes = _traced(lambda: [CompactLogs.from_logs(json.loads(p)) for p in payloads])
+    assert all(c.to_logs() == d for c, d in zip(compact, dicts)), "CompactLogs 转回 JSON 与原日志不一致"
+    print(f"{args.users} 用户 x {args.years} 年, 共 {days} 天日志")
+    print(f"  dict (JSON 结构):   {dict_bytes / 1024:>10.1f} KB  ({dict_bytes / days:.0f} B/天)")
+    print(f"  CompactLogs:        {compact_bytes / 1024:>10.1f} KB  ({compact_bytes / days:.0f} B/天)")
+    print(f"  节省 {1 - compact_bytes / dict_bytes:.1%}")
+
+# ==========================================
+# 🚀 冷启动
+# ==========================================
+STARTUP_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+t2 = time.perf_counter()
+at.run()
+t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_run_ms": (t2 - t1) * 1000, "rerun_ms": (t3 - t2) * 1000,
+                  "pandas": "pandas" in sys.modules, "numpy": "numpy" in sys.modules, "errors": len(at.exception)}))
+"""
+
+def cmd_startup(args):
+    # 每次都在新进程里渲染登录页: import streamlit, 首次运行脚本 (≈首屏), 再跑一次 rerun; 同时检查登录页是否加载了 pandas/NumPy
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = {**os.environ, "CYCLE_STORAGE": "sqlite"}
+            out = subprocess.run([sys.executable, "-c", STARTUP_PROBE, script], cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+    for key in ("import_ms", "first_run_ms", "rerun_ms"):
+        vals = sorted(r[key] for r in runs)
+        print(f"{key:<14}p50 {statistics.median(vals):>8.1f} ms   max {vals[-1]:>8.1f} ms")
+    print(f"登录页加载 pandas: {any(r['pandas'] for r in runs)}, NumPy: {any(r['numpy'] for r in runs)}, 异常: {sum(r['errors'] for r in runs)}")
+
+# ==========================================
+# 🔑 登录延迟
+# ==========================================
+def legacy_login(u, p):
+    # 旧流程: 读取整条用户元数据 + 无盐 SHA-256
+    meta = DataManager.load_user(u)
+    return meta is not None and AuthSystem.legacy_hash(p) == meta["password"]
+
+def cmd_login(args):
+    # 不同日志量下比较 旧登录 (读整条记录 + SHA-256) 与 凭据索引 + KDF 的延迟; 新流程不随日志量增长
+    print(f"KDF: {AuthSystem.KDF}, 单次哈希 {measure(lambda: AuthSystem.make_hashes('test'), 5)['mean_ms']:.1f} ms")
+    print(f"{'年':>6}{'旧 p50':>12}{'旧 p95':>12}{'新 p50':>12}{'新 p95':>12}{'并发 吞吐/s':>14}")
+    for years in args.years:
+        with tempfile.TemporaryDirectory() as workdir:
+            backend = make_backend(args.backend, workdir)
+            gen = SyntheticDataGenerator(args.seed)
+            hashed = AuthSystem.make_hashes("test")
+            for u, rec in gen.users(args.users, years):
+                rec["password"] = hashed; backend.create_user(u, rec)
+            legacy = JsonFileBackend(os.path.join(workdir, "legacy.json"))
+            legacy.save_all({"users": {u: {**rec, "password": SyntheticDataGenerator.PASSWORD_HASH} for u, rec in gen.users(args.users, years)}})
+            names = backend.usernames()
+            rng = random.Random(args.seed)
+            DataManager.use(legacy)
+            old = measure(lambda: legacy_login(rng.choice(names), "test"), args.repeat)
+            DataManager.use(backend)
+            new = measure(lambda: AuthSystem.login(rng.choice(names), "test"), args.repeat)
+            t = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as pool: ok = all(pool.map(lambda u: AuthSystem.login(u, "test"), [rng.choice(names) for _ in range(args.repeat)]))
+            rate = args.repeat / (time.perf_counter() - t)
+            DataManager.use(None)
+            assert ok
+            print(f"{years:>6}{old['p50_ms']:>12.2f}{old['p95_ms']:>12.2f}{new['p50_ms']:>12.2f}{new['p95_ms']:>12.2f}{rate:>14.0f}")
+
+# ==========================================
+# 🛰️ 数据服务负载测试
+# ==========================================
+def _service_worker(kind, target, users, seconds, write_ratio, seed, token=None):
+    # 模拟一个 Streamlit 进程: 会话级 UserCache 读取 + 按比例保存日志
+    DataManager.use(RemoteBackend(target, token=token) if kind == "remote" else SQLiteBackend(target))
+    rng, cache = random.Random(seed), UserCache()
+    cache.MAX_RETRIES = 1000
+    ops = writes = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        u = rng.choice(users)
+        user = cache.get(u)
+        if rng.random() < write_ratio:
+            day = (date(2030, 1, 1) + timedelta(days=rng.randrange(3650))).isoformat()
+            cache.save_log(u, user, day, {"primary_mood": "平静", "secondary_moods": [], "energy": 50, "symptoms": [], "meds": [], "note": "", "phase": "luteal"})
+            writes += 1
+        ops += 1
+    return ops, writes
+
+def cmd_service(args):
+    # 同一份数据分别用 直连 SQLite 和 数据服务 (RemoteBackend) 跑 1..N 个进程, 比较吞吐随进程数的变化
+    import data_service
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "service.db")
+        SyntheticDataGenerator(args.seed).populate(SQLiteBackend(path), args.users, args.years)
+        service = data_service.DataService(SQLiteBackend(path))
+        address = os.path.join(workdir, "service.sock") if hasattr(socket, "AF_UNIX") else "127.0.0.1:0"
+        token = os.urandom(16).hex()
+        server = data_service.make_server(service, address, token)
+        if not hasattr(socket, "AF_UNIX"): address = "%s:%d" % server.server_address
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        users = SQLiteBackend(path).usernames()
+        print(f"{args.users} 用户, 每轮 {args.seconds}s, 写入比例 {args.write_ratio:.0%}, CPU {os.cpu_count()}")
+        print(f"{'进程数':>6}{'直连 ops/s':>14}{'服务 ops/s':>14}{'服务 写入/s':>14}")
+        for n in args.workers:
+            row = []
+            for kind, target in (("direct", path), ("remote", address)):
+                with ProcessPoolExecutor(n) as pool:
+                    res = list(pool.map(_service_worker, [kind] * n, [target] * n, [users] * n, [args.seconds] * n, [args.write_ratio] * n, range(n), [token] * n))
+                row.append((sum(r[0] for r in res) / args.seconds, sum(r[1] for r in res) / args.seconds))
+            print(f"{n:>6}{row[0][0]:>14.0f}{row[1][0]:>14.0f}{row[1][1]:>14.0f}")
+        st_ = service.handle("stats", [])
+        print(f"服务端: 缓存命中 {st_['hits']}/{st_['hits'] + st_['misses']}, 平均每批写入 {st_['batched_writes'] / max(st_['batches'], 1):.1f} 条")
+        server.shutdown()
+
+# ==========================================
+# 🔨 并发写入压力测试
+# ==========================================
+def _stress_thread(username, proc_id, thread_id, writes, n_names):
+    cache = UserCache()
+    cache.MAX_RETRIES = 10_000
+    saved, registered = 0, []
+    base = date(2000, 1, 1) + timedelta(days=(proc_id * 1000 + thread_id) * writes)
+    for i in range(writes):
+        user = cache.get(username)
+        day = (base + timedelta(days=i)).isoformat()
+        entry = {"primary_mood": "平静", "secondary_moods": [], "energy": i % 100, "symptoms": ["头痛 (Headache)"], "meds": [], "note": f"{proc_id}/{thread_id}/{i}", "phase": "luteal"}
+        if cache.save_log(username, user, day, entry): saved += 1
+        name = f"reg{(proc_id * 31 + thread_id * 7 + i) % n_names}"
+        if DataManager.create_user(name, new_user_record("!")): registered.append(name)
+    return saved, registered, cache.conflicts
+
+def _stress_process(kind, path, proc_id, threads, writes, n_names):
+    DataManager.use(JsonFileBackend(path) if kind == "json" else SQLiteBackend(path))
+    with ThreadPoolExecutor(threads) as pool:
+        futures = [pool.submit(_stress_thread, "stress", proc_id, t, writes, n_names) for t in range(threads)]
+        return [f.result() for f in futures]
+
+def cmd_stress(args):
+    # 多进程 x 多线程同时给同一个用户写不同日期的日志并抢注同名账号, 结束后校验没有写入丢失
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "stress.json" if args.backend == "json" else "stress.db")
+        backend = JsonFileBackend(path) if args.backend == "json" else SQLiteBackend(path)
+        backend.create_user("stress", new_user_record("!"))
+        t = time.perf_counter()
+        with ProcessPoolExecutor(args.procs) as pool:
+            futures = [pool.submit(_stress_process, args.backend, path, p, args.threads, args.writes, args.names) for p in range(args.procs)]
+            results = [r for f in futures for r in f.result()]
+        elapsed = time.perf_counter() - t
+        expected = args.procs * args.threads * args.writes
+        user = backend.get_user("stress")
+        logs = user["cycle_data"]["logs"]
+        regs = [n for _, r, _ in results for n in r]
+        # 实际尝试过的名字 (与 _stress_thread 的取名规则一致): 每个恰好注册成功一次
+        attempted = {f"reg{(p * 31 + t * 7 + i) % args.names}" for p in range(args.procs) for t in range(args.threads) for i in range(args.writes)}
+        checks = {
+            "每次写入都成功": sum(s for s, _, _ in results) == expected,
+            "日志条数": len(logs) == expected,
+            "rev 计数": user.get("rev") == expected,
+            "月度汇总与全量重建一致": user["rollups"] == AnalyticsEngine.rebuild(logs, user["cycle_data"]["dates"]),
+            "同名账号只注册成功一次": sorted(regs) == sorted(attempted),
+        }
+        print(f"{args.procs} 进程 x {args.threads} 线程 x {args.writes} 次写入 ({args.backend}): {elapsed:.2f}s, "
+              f"{expected / elapsed:.0f} 写入/s, 冲突重试 {sum(c for _, _, c in results)} 次")
+        for name, ok in checks.items(): print(f"  {'✅' if ok else '❌'} {name}")
+        if not all(checks.values()): sys.exit(1)
+
+def cmd_generate(args):
+    backend = JsonFileBackend(args.path) if args.backend == "json" else SQLiteBackend(args.path)
+    SyntheticDataGenerator(args.seed).populate(backend, args.users, args.years)
+    print(f"已生成 {args.users} 个用户 x {args.years} 年 -> {args.path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleHealth 合成数据与基准测试")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("suite", help="数据/渲染路径基准测试")
+    s.add_argument("--users", type=int, nargs="+", default=[1, 100, 10_000])
+    s.add_argument("--years", type=float, default=1)
+    s.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    s.add_argument("--repeat", type=int, default=50)
+    s.add_argument("--seed", type=int, default=42)
+    s.add_argument("--out", help="结果写入 JSON, 可作为之后的 --baseline")
+    s.add_argument("--baseline", help="与之前的结果比较, 回归时退出码为 1")
+    s.add_argument("--tolerance", type=float, default=1.5)
+    s.set_defaults(func=cmd_suite)
+    st_ = sub.add_parser("stress", help="并发写入压力测试")
+    st_.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    st_.add_argument("--procs", type=int, default=4)
+    st_.add_argument("--threads", type=int, default=4)
+    st_.add_argument("--writes", type=int, default=25)
+    st_.add_argument("--names", type=int, default=10, help="被抢注的账号名个数")
+    st_.set_defaults(func=cmd_stress)
+    m = sub.add_parser("memory", help="日志内存占用对比 (dict vs CompactLogs)")
+    m.add_argument("--users", type=int, default=100)
+    m.add_argument("--years", type=float, default=2)
+    m.add_argument("--seed", type=int, default=42)
+    m.set_defaults(func=cmd_memory)
+    lg = sub.add_parser("login", help="登录延迟 (旧 SHA-256 流程 vs 凭据索引 + KDF)")
+    lg.add_argument("--users", type=int, default=50)
+    lg.add_argument("--years", type=float, nargs="+", default=[0.1, 1, 5])
+    lg.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    lg.add_argument("--repeat", type=int, default=20)
+    lg.add_argument("--concurrency", type=int, default=8)
+    lg.add_argument("--seed", type=int, default=42)
+    lg.set_defaults(func=cmd_login)
+    su = sub.add_parser("startup", help="登录页冷启动/首屏耗时")
+    su.add_argument("--repeat", type=int, default=5)
+    su.set_defaults(func=cmd_startup)
+    sv = sub.add_parser("service", help="数据服务负载测试 (吞吐 vs 进程数)")
+    sv.add_argument("--users", type=int, default=200)
+    sv.add_argument("--years", type=float, default=1)
+    sv.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    sv.add_argument("--seconds", type=float, default=3)
+    sv.add_argument("--write-ratio", type=float, default=0.1)
+    sv.add_argument("--seed", type=int, default=42)
+    sv.set_defaults(func=cmd_service)
+    g = sub.add_parser("generate", help="生成合成数据集")
+    g.add_argument("path")
+    g.add_argument("--users", type=int, default=100)
+    g.add_argument("--years", type=float, default=1)
+    g.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    g.add_argument("--seed", type=int, default=42)
+    g.set_defaults(func=cmd_generate)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
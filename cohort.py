@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from main import SQLiteBackend, JsonFileBackend, CycleStats, AnalyticsEngine, MedicalEngine, DB_FILE, DATA_FILE
+
+# ==========================================
+# 👥 群体统计: 全体用户分片到进程池, 每片产出部分聚合, 汇总后做 k-匿名抑制
+# ==========================================
+K_ANON = 10        # 少于 K 个不同用户贡献的格子不输出
+SHARD_SIZE = 2000
+AGE_BAND = 5
+
+def age_band(age):
+    if not isinstance(age, int) or not 10 <= age < 70: return "未知"
+    lo = age // AGE_BAND * AGE_BAND
+    return f"{lo}-{lo + AGE_BAND - 1}"
+
+def user_cells(rec):
+    # 一个用户对各统计格子的贡献 {(表, 键...): 次数}; 汇总时同时累计 "次数" 和 "贡献的用户数"
+    cells = Counter()
+    band = age_band(rec.get("profile", {}).get("age"))
+    cells[("users", band)] = 1
+    dates = sorted(set(rec["cycle_data"].get("dates", [])))
+    for a, b in zip(dates, dates[1:]):
+        gap = (date.fromisoformat(b) - date.fromisoformat(a)).days
+        if CycleStats.MIN_GAP < gap < CycleStats.MAX_GAP: cells[("cycle_len", band, gap)] += 1
+    for ph, p in AnalyticsEngine.window(AnalyticsEngine.for_user(rec))["phases"].items():
+        cells[("phase_days", ph)] += p["days"]
+        for s, n in p["symptoms"].items(): cells[("phase_symptom", ph, s)] += n
+    for entry in rec["cycle_data"].get("logs", {}).values():
+        if not entry: continue
+        habits = [h for h in entry.get("meds", []) if h != "无"]
+        symptoms = [s for s in entry.get("symptoms", []) if s != "无"]
+        cells[("days",)] += 1
+        for h in habits: cells[("habit_days", h)] += 1
+        for s in symptoms: cells[("symptom_days", s)] += 1
+        for h in habits:
+            for s in symptoms: cells[("cooc", h, s)] += 1
+    return cells
+
+_backends = {}
+
+def _backend(kind, path):
+    # 每个工作进程各自打开一次存储
+    if (kind, path) not in _backends: _backends[kind, path] = JsonFileBackend(path) if kind == "json" else SQLiteBackend(path)
+    return _backends[kind, path]
+
+def map_shard(job):
+    # 一个分片 -> {格子: [次数, 用户数]}; job 里是用户名 (各进程自己读 SQLite) 或直接是记录 (JSON 后端由主进程读好分发)
+    kind, path, shard = job
+    records = (r for _, r in (shard if kind == "json" else _backend(kind, path).get_users(shard)))
+    acc = {}
+    for rec in records:
+        for key, n in user_cells(rec).items():
+            a = acc.get(key)
+            if a is None: acc[key] = [n, 1]
+            else: a[0] += n; a[1] += 1
+    return acc
+
+def reduce_into(acc, part):
+    for key, (n, users) in part.items():
+        a = acc.get(key)
+        if a is None: acc[key] = [n, users]
+        else: a[0] += n; a[1] += users
+    return acc
+
+def shards(kind, path, shard_size):
+    if kind == "json":
+        users = list(JsonFileBackend(path).iter_users())
+        for i in range(0, len(users), shard_size): yield kind, path, users[i:i + shard_size]
+        return
+    names = SQLiteBackend(path).usernames()
+    for i in range(0, len(names), shard_size): yield kind, path, names[i:i + shard_size]
+
+def run(kind, path, procs=None, shard_size=SHARD_SIZE):
+    acc = {}
+    if procs == 1:
+        for job in shards(kind, path, shard_size): reduce_into(acc, map_shard(job))
+        return acc
+    with ProcessPoolExecutor(procs) as pool:
+        for part in pool.map(map_shard, shards(kind, path, shard_size)): reduce_into(acc, part)
+    return acc
+
+def _percentile(hist, q):
+    total, seen = sum(hist.values()), 0
+    for k in sorted(hist):
+        seen += hist[k]
+        if seen >= q * total: return k
+
+def finalize(acc, k=K_ANON, top=20):
+    # 只输出至少 k 个不同用户贡献的格子; 不含任何用户名
+    get = lambda table: {key[1:]: v for key, v in acc.items() if key[0] == table}
+    ok = lambda v: v[1] >= k
+    suppressed = sum(1 for v in acc.values() if not ok(v))
+    bands = {b: v[0] for (b,), v in get("users").items() if ok(v)}
+    cycle = {}
+    for (band, gap), v in get("cycle_len").items():
+        if band in bands: cycle.setdefault(band, {})[gap] = v
+    cycle_len = {}
+    for band, cells in sorted(cycle.items()):
+        # 均值/分位数也只用通过 k 阈值的格子算, 否则 P10/P90 会暴露被抑制的极端周期长度
+        hist = {g: v[0] for g, v in cells.items() if ok(v)}
+        if not hist: continue
+        n = sum(hist.values())
+        cycle_len[band] = {"users": bands[band], "cycles": n, "mean": round(sum(g * c for g, c in hist.items()) / n, 1),
+                           "p10": _percentile(hist, 0.1), "p50": _percentile(hist, 0.5), "p90": _percentile(hist, 0.9),
+                           "hist": dict(sorted(hist.items()))}
+    phase_days = {ph: v[0] for (ph,), v in get("phase_days").items() if ok(v)}
+    prevalence = {}
+    for (ph, s), v in get("phase_symptom").items():
+        if ph in phase_days and ok(v): prevalence.setdefault(MedicalEngine.PHASE_NAMES.get(ph, ph), {})[s] = round(100 * v[0] / phase_days[ph], 1)
+    days = acc.get(("days",), [0, 0])[0]
+    habit_days, symptom_days = get("habit_days"), get("symptom_days")
+    pairs = []
+    for (h, s), v in get("cooc").items():
+        if not ok(v) or not days: continue
+        lift = v[0] * days / (habit_days[(h,)][0] * symptom_days[(s,)][0])
+        pairs.append({"habit": h, "symptom": s, "days": v[0], "users": v[1], "lift": round(lift, 2)})
+    pairs.sort(key=lambda p: -p["lift"])
+    return {"k": k, "users": sum(bands.values()), "log_days": days, "suppressed_cells": suppressed,
+            "cycle_length_by_age": cycle_len,
+            "symptom_prevalence_by_phase": {ph: dict(sorted(c.items(), key=lambda x: -x[1])) for ph, c in prevalence.items()},
+            "habit_symptom_cooccurrence": pairs[:top]}
+
+def print_summary(report):
+    print(f"用户 {report['users']} 人, 日志 {report['log_days']} 天, k={report['k']}, 抑制 {report['suppressed_cells']} 个格子")
+    print("\n周期长度 (按年龄段):")
+    for band, c in report["cycle_length_by_age"].items():
+        print(f"  {band:>6}: {c['users']:>7} 人 {c['cycles']:>8} 个周期  均值 {c['mean']}  P10/P50/P90 {c['p10']}/{c['p50']}/{c['p90']}")
+    print("\n各阶段症状发生率 (每 100 天, 前 3):")
+    for ph, c in report["symptom_prevalence_by_phase"].items():
+        print(f"  {ph}: " + ", ".join(f"{s} {r}" for s, r in list(c.items())[:3]))
+    print("\n习惯-症状共现 (lift 前 5):")
+    for p in report["habit_symptom_cooccurrence"][:5]: print(f"  {p['habit']} + {p['symptom']}: {p['days']} 天, lift {p['lift']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleHealth 匿名群体统计 (多进程 map/reduce)")
+    parser.add_argument("--backend", choices=["sqlite", "json"], default=os.environ.get("CYCLE_STORAGE", "sqlite") if os.environ.get("CYCLE_STORAGE") != "remote" else "sqlite")
+    parser.add_argument("--path", help="数据库/数据文件路径, 默认 cycle_data.db / cycle_data.json")
+    parser.add_argument("--procs", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("-k", type=int, default=K_ANON, help="k-匿名阈值")
+    parser.add_argument("--out", help="结果写入 JSON 文件")
+    args = parser.parse_args()
+    path = args.path or (DATA_FILE if args.backend == "json" else DB_FILE)
+    t = time.perf_counter()
+    report = finalize(run(args.backend, path, args.procs, args.shard_size), args.k)
+    print_summary(report)
+    print(f"\n耗时 {time.perf_counter() - t:.1f}s ({args.procs} 进程)", file=sys.stderr)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
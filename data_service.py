@@ -0,0 +1,158 @@
+import argparse
+import hmac
+import ipaddress
+import os
+import queue
+import socket
+import socketserver
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from main import DataManager, SERVICE_ADDRESS, AUTH_FRAME, parse_address, send_frame, recv_frame, service_token, SERVICE_TOKEN_FILE, VersionConflict, StorageError
+
+# ==========================================
+# 🛰️ 本地数据服务: 独占存储 + 内存缓存, 多个 Streamlit 进程通过 RemoteBackend 访问
+# ==========================================
+class DataService:
+    # 读: 按用户缓存完整记录/元数据 (LRU); 写: 所有连接的日志/元数据写入进同一个队列, 写线程攒批后一次事务提交 (组提交)
+    CACHE_SIZE = 2048
+    BATCH_MAX = 64
+
+    def __init__(self, backend, cache_size=CACHE_SIZE, batch_max=BATCH_MAX):
+        self.backend, self.cache_size, self.batch_max = backend, cache_size, batch_max
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.seen = backend.version_token()
+        self.generation = 0  # 每次失效 +1: 失效前开始的读取不会把旧值放回缓存
+        self.writes = queue.Queue()
+        self.stats = {"requests": 0, "hits": 0, "misses": 0, "batches": 0, "batched_writes": 0}
+        threading.Thread(target=self._writer, name="writer", daemon=True).start()
+
+    # ---- 缓存 ----
+    def _check_external(self):
+        # 其他进程直接改了存储 (如导入脚本): 整体清空缓存
+        token = self.backend.version_token()
+        if token != self.seen:
+            with self.lock: self.cache.clear(); self.seen = token; self.generation += 1
+
+    def _cached(self, key, load):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key); self.stats["hits"] += 1
+                return self.cache[key]
+            gen = self.generation
+        self.stats["misses"] += 1
+        value = load()
+        with self.lock:
+            if gen != self.generation: return value
+            self.cache[key] = value
+            while len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+        return value
+
+    def _invalidate(self, usernames):
+        with self.lock:
+            for u in usernames: self.cache.pop(("user", u), None); self.cache.pop(("meta", u), None)
+            self.seen = self.backend.version_token()
+            self.generation += 1
+
+    # ---- 攒批写入 ----
+    def _writer(self):
+        while True:
+            batch = [self.writes.get()]
+            while len(batch) < self.batch_max:
+                try: batch.append(self.writes.get_nowait())
+                except queue.Empty: break
+            try: errors = self.backend.write_batch([item for item, _ in batch])
+            except Exception as e: errors = [e] * len(batch)
+            self._invalidate({item[0] for item, _ in batch})
+            self.stats["batches"] += 1; self.stats["batched_writes"] += len(batch)
+            for (_, fut), err in zip(batch, errors):
+                if err is None: fut.set_result(None)
+                else: fut.set_exception(err)
+
+    def _write(self, username, meta, logs, base_rev):
+        fut = Future()
+        self.writes.put(((username, meta, logs, base_rev), fut))
+        return fut.result()
+
+    # ---- 请求分发 ----
+    def _page(self, after, limit, load):
+        return [(u, rec) for u in self.backend.usernames_after(after, limit) if (rec := load(u)) is not None]
+
+    def handle(self, op, args):
+        self.stats["requests"] += 1
+        self._check_external()
+        b = self.backend
+        if op == "version_token": return self.seen
+        if op == "user_token": return b.user_token(args[0])
+        if op == "get_user": return self._cached(("user", args[0]), lambda: b.get_user(args[0]))
+        if op == "get_meta": return self._cached(("meta", args[0]), lambda: b.get_meta(args[0]))
+        if op == "usernames": return b.usernames()
+        if op == "user_page": return self._page(args[0], args[1], lambda u: self._cached(("user", u), lambda: b.get_user(u)))
+        if op == "meta_page": return self._page(args[0], args[1], lambda u: self._cached(("meta", u), lambda: b.get_meta(u)))
+        if op == "get_credential": return b.get_credential(args[0])
+        if op == "save_meta": return self._write(args[0], args[1], {}, args[2])
+        if op == "save_log": return self._write(args[0], args[3], {args[1]: args[2]}, args[4])
+        if op == "save_logs": return self._write(args[0], args[2], args[1], args[3])
+        if op == "stats": return {**self.stats, "cached": len(self.cache)}
+        if op in ("create_user", "set_credential"):
+            result = getattr(b, op)(*args)
+            self._invalidate([args[0]])
+            return result
+        raise ValueError(f"未知操作: {op}")
+
+class Handler(socketserver.BaseRequestHandler):
+    def _authenticate(self):
+        # 第一帧必须是 ["auth", [密钥]]; 认证前只收很小的帧
+        try: req = recv_frame(self.request, AUTH_FRAME)
+        except (OSError, ValueError): return False
+        ok = (isinstance(req, list) and len(req) == 2 and req[0] == "auth" and isinstance(req[1], list) and req[1]
+              and isinstance(req[1][0], str) and hmac.compare_digest(req[1][0].encode(), self.server.token.encode()))
+        try: send_frame(self.request, {"result": True} if ok else {"error": "StorageError", "message": "认证失败"})
+        except OSError: return False
+        return ok
+
+    def handle(self):
+        service = self.server.service
+        if not self._authenticate(): return
+        while True:
+            try: req = recv_frame(self.request)
+            except (OSError, ValueError): return
+            if req is None: return
+            op, args = req
+            try: resp = {"result": service.handle(op, args)}
+            except (VersionConflict, StorageError, ValueError) as e: resp = {"error": type(e).__name__, "message": str(e)}
+            except Exception as e: resp = {"error": "StorageError", "message": f"{type(e).__name__}: {e}"}
+            try: send_frame(self.request, resp)
+            except OSError: return
+
+def make_server(service, address=SERVICE_ADDRESS, token=None):
+    # 每个连接先用共享密钥认证; TCP 另外只允许监听本机回环地址, Unix socket 在 umask 077 下创建 (只对当前用户可读写)
+    family, target = parse_address(address)
+    if family == socket.AF_INET:
+        if not ipaddress.ip_address(socket.gethostbyname(target[0])).is_loopback: raise ValueError(f"数据服务只能监听本机回环地址: {address}")
+        base = socketserver.ThreadingTCPServer
+    else:
+        base = socketserver.ThreadingUnixStreamServer
+        if os.path.exists(target): os.unlink(target)  # 上次未正常退出留下的 socket 文件
+    old = os.umask(0o077)
+    try: server = type("Server", (base,), {"daemon_threads": True, "allow_reuse_address": True})(target, Handler)
+    finally: os.umask(old)
+    server.service, server.token = service, token or service_token(create=True)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleHealth 本地数据服务 (配合 CYCLE_STORAGE=remote 的多个 Streamlit 进程)")
+    parser.add_argument("--backend", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--address", default=SERVICE_ADDRESS, help="Unix socket 路径或 host:port")
+    parser.add_argument("--cache-size", type=int, default=DataService.CACHE_SIZE)
+    parser.add_argument("--batch-max", type=int, default=DataService.BATCH_MAX)
+    args = parser.parse_args()
+    service = DataService(DataManager.create_backend(args.backend), args.cache_size, args.batch_max)
+    with make_server(service, args.address) as server:
+        print(f"数据服务已启动: {args.address} ({args.backend}), 连接密钥: {SERVICE_TOKEN_FILE}", flush=True)
+        try: server.serve_forever()
+        except KeyboardInterrupt: pass
+
+if __name__ == "__main__":
+    main()
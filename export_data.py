@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import sys
+import pandas as pd
+from main import DataManager, UserCache, CycleStats, AnalyticsEngine, CyclePredictor, VersionConflict, StorageError, new_user_record
+
+# ==========================================
+# 📦 批量导出 / 导入 (每个用户每天一行的列式表)
+# ==========================================
+COLUMNS = ["username", "day", "period_start", "primary_mood", "secondary_moods", "energy", "symptoms", "meds", "note", "phase"]
+LIST_COLUMNS = ["secondary_moods", "symptoms", "meds"]
+CHUNK_ROWS = 50_000
+FORMATS = ("csv", "parquet", "arrow")
+
+def user_rows(username, user):
+    # 日志和经期日期合并成按天的行; 旧格式的 moods 拆成主要/次要情绪
+    c_data = user["cycle_data"]
+    logs, starts = c_data.get("logs", {}), set(c_data.get("dates", []))
+    for day in sorted(set(logs) | starts):
+        e = logs.get(day)
+        if e is None:
+            yield {"username": username, "day": day, "period_start": True, "primary_mood": None, "secondary_moods": [],
+                   "energy": None, "symptoms": [], "meds": [], "note": None, "phase": None}
+            continue
+        moods = AnalyticsEngine.entry_moods(e)
+        yield {"username": username, "day": day, "period_start": day in starts,
+               "primary_mood": e.get("primary_mood") or (moods[0] if moods else None),
+               "secondary_moods": list(e.get("secondary_moods") or moods[1:]), "energy": e.get("energy"),
+               "symptoms": list(e.get("symptoms", [])), "meds": list(e.get("meds", [])), "note": e.get("note"), "phase": e.get("phase")}
+
+def iter_chunks(users, chunk_rows=CHUNK_ROWS):
+    # 按用户流式读取, 攒够 chunk_rows 行输出一个 DataFrame, 不需要整库驻留内存
+    rows = []
+    for username, user in users:
+        rows.extend(user_rows(username, user))
+        if len(rows) >= chunk_rows:
+            yield _frame(rows); rows = []
+    if rows: yield _frame(rows)
+
+def _frame(rows):
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df["energy"] = df["energy"].astype("Int64")
+    return df
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        return pa
+    except ImportError: sys.exit("parquet/arrow 格式需要安装 pyarrow: pip install pyarrow")
+
+def _arrow_schema(pa):
+    lst = pa.list_(pa.string())
+    return pa.schema([("username", pa.string()), ("day", pa.string()), ("period_start", pa.bool_()), ("primary_mood", pa.string()),
+                      ("secondary_moods", lst), ("energy", pa.int64()), ("symptoms", lst), ("meds", lst), ("note", pa.string()), ("phase", pa.string())])
+
+def export_logs(path, fmt="csv", users=None, chunk_rows=CHUNK_ROWS):
+    users = DataManager.iter_users() if users is None else users
+    n = 0
+    if fmt == "csv":
+        # CSV 没有列表类型, 列表列存为 JSON 数组字符串
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for i, df in enumerate(iter_chunks(users, chunk_rows)):
+                for c in LIST_COLUMNS: df[c] = df[c].map(lambda v: json.dumps(v, ensure_ascii=False))
+                df.to_csv(f, header=(i == 0), index=False); n += len(df)
+            if n == 0: pd.DataFrame(columns=COLUMNS).to_csv(f, index=False)
+        return n
+    pa = _arrow()
+    schema = _arrow_schema(pa)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+    else:
+        import pyarrow.ipc as ipc
+        writer = ipc.new_file(path, schema)
+    try:
+        for df in iter_chunks(users, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False)); n += len(df)
+    finally: writer.close()
+    return n
+
+def export_accounts(path, users=None):
+    # 账号 (密码哈希/档案) 单独导出, 日志表里不带敏感字段
+    users = DataManager.iter_meta() if users is None else users
+    creds = DataManager.backend().load_credentials()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({u: {"password": creds.get(u, "!"), "profile": m.get("profile", {})} for u, m in users}, f, ensure_ascii=False)
+
+def read_chunks(path, fmt="csv", chunk_rows=CHUNK_ROWS):
+    if fmt == "csv":
+        for df in pd.read_csv(path, chunksize=chunk_rows, dtype={"username": str, "day": str, "note": str}, keep_default_na=False, na_values={"energy": [""], "primary_mood": [""], "phase": [""]}):
+            for c in LIST_COLUMNS: df[c] = df[c].map(lambda v: json.loads(v) if v else [])
+            yield df
+        return
+    pa = _arrow()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows): yield batch.to_pandas()
+    else:
+        import pyarrow.ipc as ipc
+        reader = ipc.open_file(path)
+        for i in range(reader.num_record_batches): yield reader.get_batch(i).to_pandas()
+
+def _clean(v):
+    if v is None or (isinstance(v, float) and v != v) or v is pd.NA: return None
+    return v
+
+def merge_rows(user, g):
+    # 一个用户的一组行合并进记录 (原地修改), 返回新写入的日志
+    c_data = user["cycle_data"]
+    new_logs = {}
+    for r in g.itertuples(index=False):
+        if r.period_start: c_data["dates"].append(r.day)
+        if _clean(r.primary_mood) is None and not len(r.symptoms) and not len(r.meds) and _clean(r.energy) is None and not _clean(r.note): continue
+        entry = {"primary_mood": _clean(r.primary_mood) or "无", "secondary_moods": list(r.secondary_moods), "energy": None if _clean(r.energy) is None else int(r.energy),
+                 "symptoms": list(r.symptoms), "meds": list(r.meds), "note": _clean(r.note) or ""}
+        if _clean(r.phase): entry["phase"] = r.phase
+        new_logs[r.day] = entry
+    c_data["dates"] = sorted(set(c_data["dates"]))
+    c_data["logs"].update(new_logs)
+    stats = CycleStats.from_dates(c_data["dates"])
+    stats.version = user.get("cycle_stats", {}).get("version", 0) + 1
+    user["cycle_stats"] = stats.to_dict()
+    user["rollups"], user["rollups_ver"] = AnalyticsEngine.rebuild(c_data["logs"], c_data["dates"]), AnalyticsEngine.VERSION
+    user["prediction"] = CyclePredictor.predict(c_data["dates"])
+    return new_logs
+
+def import_logs(path, fmt="csv", accounts=None, chunk_rows=CHUNK_ROWS):
+    # 按块读取, 每块按用户分组合并进存储; 已有的同日日志会被覆盖, 统计/汇总/预测随之重建
+    # 与界面写入一样按 rev 比较并交换: 用户正在使用时冲突了就重新读取再合并
+    accounts = accounts or {}
+    backend = DataManager.backend()
+    n_rows, touched = 0, set()
+    for df in read_chunks(path, fmt, chunk_rows):
+        n_rows += len(df)
+        for username, g in df.groupby("username", sort=False):
+            for _ in range(UserCache.MAX_RETRIES):
+                user = backend.get_user(username)
+                if user is None:
+                    acc = accounts.get(username, {})
+                    user = new_user_record(acc.get("password", "!"))
+                    if acc.get("profile"): user["profile"] = acc["profile"]
+                    if not backend.create_user(username, user): continue  # 同时被注册: 重新读取
+                    user = backend.get_user(username)
+                base = user.get("rev", 0)
+                new_logs = merge_rows(user, g)
+                user["rev"] = base + 1
+                try: backend.save_logs(username, new_logs, meta=user, base_rev=base); break
+                except VersionConflict: continue
+            else: raise StorageError(f"{username}: 数据正在被修改, 导入失败, 请稍后重试")
+            touched.add(username)
+    return n_rows, len(touched)
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleHealth 日志批量导出/导入")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="导出所有用户日志")
+    ex.add_argument("path")
+    ex.add_argument("--accounts", help="同时导出账号信息到此 JSON 文件")
+    im = sub.add_parser("import", help="从导出文件导入日志")
+    im.add_argument("path")
+    im.add_argument("--accounts", help="账号 JSON (新建用户时使用其密码哈希与档案)")
+    for p in (ex, im):
+        p.add_argument("--format", choices=FORMATS, help="默认按扩展名判断")
+        p.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+    fmt = args.format or {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}.get(os.path.splitext(args.path)[1], "csv")
+    if args.cmd == "export":
+        n = export_logs(args.path, fmt, chunk_rows=args.chunk_rows)
+        if args.accounts: export_accounts(args.accounts)
+        print(f"已导出 {n} 行 -> {args.path}")
+    else:
+        accounts = None
+        if args.accounts:
+            with open(args.accounts, encoding="utf-8") as f: accounts = json.load(f)
+        n, users = import_logs(args.path, fmt, accounts, args.chunk_rows)
+        print(f"已导入 {n} 行, 涉及 {users} 个用户")
+
+if __name__ == "__main__":
+    main()
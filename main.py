@@ -1,24 +1,63 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
 import json
 import os
 import hashlib
+import gzip
+import hmac
+import base64
 import re
 import calendar
 import random
-import base64
+import bisect
+import queue
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+try: import fcntl
+except ImportError: fcntl = None; import msvcrt
+import time
+import functools
+import importlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from html import escape
 from datetime import date, datetime, timedelta
 
+class LazyModule:
+    # pandas / NumPy 在首次访问属性时才导入: 登录页用不到它们, 冷启动不再为此付出几百毫秒
+    def __init__(self, name): self._name, self._mod = name, None
+    def __getattr__(self, attr):
+        if self._mod is None: self._mod = importlib.import_module(self._name)
+        return getattr(self._mod, attr)
+
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+
 # ==========================================
 # 🎨 UI 美化模块 (V10.6: 像素级复刻您的截图)
 # ==========================================
-def inject_custom_css():
-    st.markdown("""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Roboto:wght@400;500&display=swap');
-    @import url('https://fonts.googleapis.com/css2?family=Nunito:wght@400;600;700&display=swap');
-    @import url('https://fonts.googleapis.com/css2?family=Dancing+Script:wght@500;700&display=swap');
+# 字体不再从 Google Fonts 下载: 只引用系统已安装的字体 (local()), 没装时按 font-family 后备列表回退到系统字体, 不阻塞渲染, 离线可用
+FONT_FACES = [("Roboto", 400), ("Roboto", 500), ("Nunito", 400), ("Nunito", 600), ("Nunito", 700), ("Dancing Script", 500), ("Dancing Script", 700)]
+
+FONT_WEIGHT_NAMES = {400: "Regular", 500: "Medium", 600: "SemiBold", 700: "Bold"}
+
+def font_faces():
+    return "".join(f"@font-face{{font-family:'{fam}';font-weight:{w};font-display:swap;src:local('{fam} {FONT_WEIGHT_NAMES[w]}'),"
+                   f"local('{fam.replace(' ', '')}-{FONT_WEIGHT_NAMES[w]}');}}"
+                   for fam, w in FONT_FACES)
+
+@st.cache_resource(show_spinner=False)
+def custom_css():
+    # 样式表每个进程只拼装/压缩一次; Streamlit 会移除本次 rerun 没有输出的元素, 所以 <style> 仍需每次输出, 但只是一段现成字符串
+    css = re.sub(r"/\*.*?\*/", "", CUSTOM_CSS, flags=re.S)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", re.sub(r"\s+", " ", css)).strip()
+    return f"<style>{font_faces()}{css}</style>"
+
+def inject_custom_css(): st.markdown(custom_css(), unsafe_allow_html=True)
+
+CUSTOM_CSS = """
     
     /* 全局背景：极淡的灰蓝色，完全还原截图背景 */
     .stApp {
@@ -175,6 +214,8 @@ def inject_custom_css():
     .calendar-day { background: #fff; border-radius: 8px; border: 1px solid #f5f5f5; min-height: 50px; padding: 2px; display: flex; flex-direction: column; align-items: center; justify-content: flex-start; }
     .day-num { font-size: 0.6em; color: #ccc; align-self: flex-start; margin-left: 3px; line-height: 1; }
     .day-today { border: 1.5px solid #ff9a9e; background: #fffafa; }
+    .phase-menstrual { background: #ffebee; } .phase-follicular { background: #f3e5f5; }
+    .phase-ovulatory { background: #fffde7; } .phase-luteal { background: #e8f5e9; }
     .mood-primary-cal { font-size: 1.4em; line-height: 1; margin-top: -2px; }
     .timeline-entry { display: flex; align-items: center; padding: 12px 0; border-bottom: 1px dashed #eee; }
     .timeline-date { width: 50px; text-align: center; font-size: 0.8em; font-weight: bold; color: #888; background: #f8f9fa; border-radius: 8px; padding: 4px; margin-right: 15px; }
@@ -182,44 +223,965 @@ def inject_custom_css():
     .timeline-details { flex: 1; }
     .timeline-sub-moods { font-size: 1.1em; letter-spacing: 3px; }
     .timeline-note { font-size: 0.85em; color: #666; margin-top: 4px; }
-    </style>
-    """, unsafe_allow_html=True)
+"""
+
+# ==========================================
+# ⏱️ 性能埋点
+# ==========================================
+class Profiler:
+    # 记录每次 rerun 各段耗时与读写字节; URL 加 ?debug=1 或 CYCLE_DEBUG=1 时在侧边栏显示, CYCLE_PERF_LOG 指定 JSONL 落盘路径
+    LOG_FILE = os.environ.get("CYCLE_PERF_LOG")
+    HISTORY = 20
+    _local = threading.local()
+
+    @classmethod
+    def start_run(cls, label=""):
+        cls._local.run = {"ts": datetime.now().isoformat(timespec="seconds"), "label": label, "t0": time.perf_counter(),
+                          "timings": [], "bytes_read": 0, "bytes_written": 0}
+
+    @classmethod
+    def current(cls): return getattr(cls._local, "run", None)
+
+    @classmethod
+    @contextmanager
+    def timer(cls, name):
+        t = time.perf_counter()
+        try: yield
+        finally:
+            run = cls.current()
+            if run is not None: run["timings"].append((name, round((time.perf_counter() - t) * 1000, 3)))
+
+    @classmethod
+    def lap(cls, name):
+        # 顺序分段计时: 记录距上一次 lap (或本次 rerun 开始) 的耗时
+        run = cls.current()
+        if run is None: return
+        now = time.perf_counter()
+        run["timings"].append((name, round((now - run.get("lap", run["t0"])) * 1000, 3)))
+        run["lap"] = now
+
+    @classmethod
+    def timed(cls, name):
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with cls.timer(name): return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    @classmethod
+    def add_bytes(cls, read=0, written=0):
+        run = cls.current()
+        if run is not None: run["bytes_read"] += read; run["bytes_written"] += written
+
+    @classmethod
+    def end_run(cls):
+        run = cls.current()
+        if run is None: return None
+        cls._local.run = None
+        run.pop("lap", None)
+        run["total_ms"] = round((time.perf_counter() - run.pop("t0")) * 1000, 3)
+        if cls.LOG_FILE:
+            with open(cls.LOG_FILE, "a", encoding="utf-8") as f: f.write(json.dumps(run, ensure_ascii=False) + "\n")
+        return run
+
+    @staticmethod
+    def enabled():
+        return os.environ.get("CYCLE_DEBUG") == "1" or st.query_params.get("debug") == "1"
+
+    @classmethod
+    def render_panel(cls, extra=None):
+        # 显示上一次完整 rerun 的明细 (当前这次还没结束) 以及本次到目前为止的数据
+        history = st.session_state.get("_perf_runs", [])
+        with st.sidebar.expander("🛠️ 性能调试", expanded=False):
+            run = cls.current()
+            if run is not None:
+                st.caption(f"本次 rerun (进行中): 读 {run['bytes_read']} B / 写 {run['bytes_written']} B")
+                st.dataframe(pd.DataFrame(run["timings"], columns=["阶段", "毫秒"]), hide_index=True, use_container_width=True)
+            if history:
+                last = history[-1]
+                st.caption(f"上次 rerun: 共 {last['total_ms']} ms, 读 {last['bytes_read']} B / 写 {last['bytes_written']} B")
+                st.dataframe(pd.DataFrame(last["timings"], columns=["阶段", "毫秒"]), hide_index=True, use_container_width=True)
+            for name, stats in (extra or {}).items(): st.caption(f"{name}: {stats}")
+            if cls.LOG_FILE: st.caption(f"已写入 {cls.LOG_FILE}")
+
+    @classmethod
+    def remember(cls, run):
+        if run is None: return
+        history = st.session_state.setdefault("_perf_runs", [])
+        history.append(run)
+        del history[:-cls.HISTORY]
 
 # ==========================================
 # 🔐 安全与数据
 # ==========================================
 DATA_FILE = "cycle_data.json"
+DB_FILE = "cycle_data.db"
+# 存储后端: sqlite (默认, 按用户读写) / json (旧版单文件) / remote (经 data_service.py 访问, 多进程部署)
+STORAGE_BACKEND = os.environ.get("CYCLE_STORAGE", "sqlite")
+
+def new_user_record(password_hash):
+    return {"password": password_hash, "profile": {"age": 25}, "cycle_data": {"dates": [], "logs": {}}}
+
+def split_user_record(record):
+    # 拆成 (元数据, 日志): 日志单独按天存储, 元数据不含 logs
+    meta = dict(record)
+    c_data = dict(meta.get("cycle_data", {}))
+    logs = c_data.pop("logs", {})
+    meta["cycle_data"] = c_data
+    return meta, logs
+
+class VersionConflict(Exception):
+    # 乐观锁冲突: 存储里的 rev 已经不是写入方读到的那个版本
+    pass
+
+class StorageError(RuntimeError): pass
+
+class FileLock:
+    # 跨进程互斥 (POSIX: fcntl.flock, Windows: msvcrt.locking) + 进程内线程锁; 同一线程可重入
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._f = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            self._f = open(self.path, "a+")
+            if fcntl: fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+            else: self._f.seek(0); msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl: fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            else: self._f.seek(0); msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+            self._f.close(); self._f = None
+        self._thread_lock.release()
+
+class JsonFileBackend:
+    # 旧版: 所有用户存在一个 JSON 文件里, 每次读写都是整个文件; 写入在文件锁内 读-改-写, 临时文件 + 原子替换
+    def __init__(self, path=DATA_FILE):
+        self.path = path
+        self.lock = FileLock(f"{path}.lock")
+
+    @Profiler.timed("json.load_all")
+    def load_all(self):
+        if not os.path.exists(self.path): return {"users": {}}
+        Profiler.add_bytes(read=os.path.getsize(self.path))
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: return json.load(f)
+        except ValueError as e:
+            # 不能当作空库处理, 否则下一次写入会覆盖掉所有用户
+            raise StorageError(f"数据文件损坏: {self.path}: {e}") from e
+
+    @Profiler.timed("json.save_all")
+    def save_all(self, data):
+        with self.lock:
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+                Profiler.add_bytes(written=f.tell())
+                f.flush(); os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    def version_token(self):
+        try: s = os.stat(self.path); return (s.st_mtime_ns, s.st_size)
+        except OSError: return None
+
+    def get_user(self, username): return self.load_all()["users"].get(username)
+    def user_token(self, username): return self.version_token()  # 单文件: 任何写入都改变整个文件, 没有更细的版本
+    def get_meta(self, username):
+        rec = self.get_user(username)
+        return split_user_record(rec)[0] if rec is not None else None
+    def usernames(self): return list(self.load_all()["users"].keys())
+    def usernames_after(self, after, limit): return sorted(u for u in self.load_all()["users"] if u > after)[:limit]
+    def iter_users(self): yield from self.load_all()["users"].items()
+    def iter_meta(self):
+        for u, rec in self.iter_users(): yield u, split_user_record(rec)[0]
+
+    def create_user(self, username, record):
+        with self.lock:
+            d = self.load_all()
+            if username in d["users"]: return False
+            d["users"][username] = record
+            self.save_all(d)
+            return True
+
+    def load_credentials(self): return {u: rec.get("password") for u, rec in self.load_all()["users"].items() if rec.get("password")}
+    def get_credential(self, username): return (self.get_user(username) or {}).get("password")
+    def set_credential(self, username, h):
+        with self.lock:
+            d = self.load_all()
+            if username in d["users"]: d["users"][username]["password"] = h; self.save_all(d)
 
-class DataManager:
     @staticmethod
-    def load_all_data():
-        if not os.path.exists(DATA_FILE): return {"users": {}}
+    def _apply(d, username, meta, logs, base_rev):
+        cur = d["users"].get(username)
+        if base_rev is not None and (cur or {}).get("rev", 0) != base_rev: raise VersionConflict(username)
+        old_logs = (cur or {}).get("cycle_data", {}).get("logs", {})
+        rec = split_user_record(meta)[0] if meta is not None else cur
+        if cur and "password" in cur: rec.setdefault("password", cur["password"])
+        rec["cycle_data"]["logs"] = {**old_logs, **logs}
+        d["users"][username] = rec
+
+    def _put(self, username, meta, logs, base_rev):
+        with self.lock:
+            d = self.load_all()
+            self._apply(d, username, meta, logs, base_rev)
+            self.save_all(d)
+
+    def write_batch(self, items):
+        # [(username, meta, logs, base_rev)] 合并成一次 读-改-写; 每项单独做 rev 比较, 返回各项的异常 (成功为 None)
+        with self.lock:
+            d, errors = self.load_all(), []
+            for item in items:
+                try: self._apply(d, *item); errors.append(None)
+                except VersionConflict as e: errors.append(e)
+            if any(e is None for e in errors): self.save_all(d)
+            return errors
+
+    def save_meta(self, username, meta, base_rev=None): self._put(username, meta, {}, base_rev)
+    def save_logs(self, username, logs, meta=None, base_rev=None): self._put(username, meta, logs, base_rev)
+    def save_log(self, username, day, entry, meta=None, base_rev=None): self._put(username, meta, {day: entry}, base_rev)
+
+class SQLiteBackend:
+    # 按用户分行: users 表存元数据, logs 表每天一行; WAL 模式, 每次写入一个事务
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, meta TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS credentials (username TEXT PRIMARY KEY, hash TEXT NOT NULL) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS logs (
+        username TEXT NOT NULL, day TEXT NOT NULL, entry TEXT NOT NULL,
+        PRIMARY KEY (username, day)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+        with self.transaction() as db:
+            # 旧库: 密码哈希从元数据搬到 credentials 表
+            db.execute("INSERT OR IGNORE INTO credentials (username, hash) SELECT username, json_extract(meta, '$.password') FROM users WHERE json_extract(meta, '$.password') IS NOT NULL")
+            db.execute("UPDATE users SET meta=json_remove(meta, '$.password') WHERE json_extract(meta, '$.password') IS NOT NULL")
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try: yield self._db
+            except:
+                self._db.execute("ROLLBACK"); raise
+            else: self._db.execute("COMMIT")
+
+    def _query(self, sql, args=()):
+        with self._lock: return self._db.execute(sql, args).fetchall()
+
+    @staticmethod
+    def _dumps(obj):
+        s = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+        Profiler.add_bytes(written=len(s))
+        return s
+
+    def version_token(self):
+        # 只看文件元数据 (主库 + WAL), 不读取内容; 任一连接提交后都会变化
+        token = []
+        for p in (self.path, f"{self.path}-wal"):
+            try: s = os.stat(p); token.append((s.st_mtime_ns, s.st_size))
+            except OSError: token.append(None)
+        return tuple(token)
+
+    @Profiler.timed("db.get_meta")
+    def get_meta(self, username):
+        rows = self._query("SELECT meta FROM users WHERE username=?", (username,))
+        if rows: Profiler.add_bytes(read=len(rows[0][0]))
+        return json.loads(rows[0][0]) if rows else None
+
+    @Profiler.timed("db.get_logs")
+    def get_logs(self, username):
+        # 在 SQLite 里用 json_group_object 拼成一个 JSON 对象 (主键顺序即日期顺序), Python 端只解析一次
+        s = self._query("SELECT json_group_object(day, json(entry)) FROM logs WHERE username=?", (username,))[0][0]
+        Profiler.add_bytes(read=len(s))
+        return json.loads(s)
+
+    def get_user(self, username):
+        meta = self.get_meta(username)
+        if meta is None: return None
+        meta.setdefault("cycle_data", {})["logs"] = self.get_logs(username)
+        return meta
+
+    def get_users(self, names, chunk=500):
+        # 批量读取 (群体统计/导出): 每批两条查询, 每个用户的元数据和日志各解析一次
+        for i in range(0, len(names), chunk):
+            part = list(names[i:i + chunk])
+            marks = ",".join("?" * len(part))
+            metas = dict(self._query(f"SELECT username, meta FROM users WHERE username IN ({marks})", part))
+            logs = dict(self._query(f"SELECT username, json_group_object(day, json(entry)) FROM logs WHERE username IN ({marks}) GROUP BY username", part))
+            for u in part:
+                if u not in metas: continue
+                rec = json.loads(metas[u])
+                rec.setdefault("cycle_data", {})["logs"] = json.loads(logs.get(u, "{}"))
+                yield u, rec
+
+    def usernames(self): return [r[0] for r in self._query("SELECT username FROM users ORDER BY username")]
+    def user_token(self, username):
+        # 单个用户的版本: 每次写入 rev 都会前进; 只读一个 JSON 字段, 其他用户的写入不会让这个用户的会话缓存失效
+        rows = self._query("SELECT COALESCE(json_extract(meta, '$.rev'), 0) FROM users WHERE username=?", (username,))
+        return rows[0][0] if rows else None
+
+    def usernames_after(self, after, limit):
+        # 按用户名分页 (主键索引范围扫描), 数据服务的 iter_users/iter_meta 用
+        return [r[0] for r in self._query("SELECT username FROM users WHERE username > ? ORDER BY username LIMIT ?", (after, limit))]
+    def iter_users(self):
+        for u in self.usernames():
+            rec = self.get_user(u)
+            if rec is not None: yield u, rec
+    def iter_meta(self):
+        for u, meta in self._query("SELECT username, meta FROM users ORDER BY username"): yield u, json.loads(meta)
+
+    @Profiler.timed("db.create_user")
+    def create_user(self, username, record):
+        meta, logs = split_user_record(record)
+        password = meta.pop("password", None)
+        with self.transaction() as db:
+            if db.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone(): return False
+            db.execute("INSERT INTO users (username, meta) VALUES (?, ?)", (username, self._dumps(meta)))
+            if password is not None: db.execute("INSERT OR REPLACE INTO credentials (username, hash) VALUES (?, ?)", (username, password))
+            db.executemany("INSERT INTO logs (username, day, entry) VALUES (?, ?, ?)",
+                           [(username, k, self._dumps(v)) for k, v in logs.items()])
+        return True
+
+    def load_credentials(self): return dict(self._query("SELECT username, hash FROM credentials"))
+    def get_credential(self, username):
+        rows = self._query("SELECT hash FROM credentials WHERE username=?", (username,))
+        return rows[0][0] if rows else None
+    def set_credential(self, username, h):
+        with self.transaction() as db: db.execute("UPDATE credentials SET hash=? WHERE username=?", (h, username))
+
+    def _put(self, username, meta, logs, base_rev):
+        # 元数据和日志在同一事务里写入; 给了 base_rev 时做比较并交换, 存储中的 rev 不一致就回滚并抛 VersionConflict
+        with self.transaction() as db: self._put_in(db, username, meta, logs, base_rev)
+
+    def write_batch(self, items):
+        # [(username, meta, logs, base_rev)] 放进同一个事务 (一次提交); 每项一个 savepoint, rev 冲突只回滚该项; 返回各项的异常 (成功为 None)
+        errors = []
+        with self.transaction() as db:
+            for item in items:
+                db.execute("SAVEPOINT w")
+                try: self._put_in(db, *item); errors.append(None)
+                except VersionConflict as e: db.execute("ROLLBACK TO w"); errors.append(e)
+                db.execute("RELEASE w")
+        return errors
+
+    def _put_in(self, db, username, meta, logs, base_rev):
+        if meta is not None:
+            m = split_user_record(meta)[0]; m.pop("password", None)
+            m = self._dumps(m)
+            if base_rev is None:
+                db.execute("INSERT INTO users (username, meta) VALUES (?, ?) ON CONFLICT(username) DO UPDATE SET meta=excluded.meta", (username, m))
+            elif db.execute("UPDATE users SET meta=? WHERE username=? AND COALESCE(json_extract(meta, '$.rev'), 0)=?",
+                            (m, username, base_rev)).rowcount == 0:
+                raise VersionConflict(username)
+        db.executemany("INSERT INTO logs (username, day, entry) VALUES (?, ?, ?) ON CONFLICT(username, day) DO UPDATE SET entry=excluded.entry",
+                       [(username, k, self._dumps(v)) for k, v in logs.items()])
+
+    @Profiler.timed("db.save_meta")
+    def save_meta(self, username, meta, base_rev=None): self._put(username, meta, {}, base_rev)
+    @Profiler.timed("db.save_log")
+    def save_log(self, username, day, entry, meta=None, base_rev=None): self._put(username, meta, {day: entry}, base_rev)
+    @Profiler.timed("db.save_logs")
+    def save_logs(self, username, logs, meta=None, base_rev=None): self._put(username, meta, logs, base_rev)
+
+    def load_all(self):
+        creds = self.load_credentials()
+        users = {}
+        for u, rec in self.iter_users():
+            if u in creds: rec["password"] = creds[u]
+            users[u] = rec
+        return {"users": users}
+
+    def save_all(self, data):
+        with self.transaction() as db:
+            db.execute("DELETE FROM logs"); db.execute("DELETE FROM users"); db.execute("DELETE FROM credentials")
+            for u, rec in data["users"].items():
+                meta, logs = split_user_record(rec)
+                if "password" in meta: db.execute("INSERT INTO credentials (username, hash) VALUES (?, ?)", (u, meta.pop("password")))
+                db.execute("INSERT INTO users (username, meta) VALUES (?, ?)", (u, self._dumps(meta)))
+                db.executemany("INSERT INTO logs (username, day, entry) VALUES (?, ?, ?)",
+                               [(u, k, self._dumps(v)) for k, v in logs.items()])
+
+    def import_json(self, json_path):
+        # 迁移: 仅当数据库为空时, 一次性导入旧版 JSON 文件 (原文件保留不动)
+        if not os.path.exists(json_path) or self._query("SELECT 1 FROM users LIMIT 1"): return 0
+        data = JsonFileBackend(json_path).load_all()
+        if data.get("users"): self.save_all(data)
+        return len(data.get("users", {}))
+
+# 数据服务 (data_service.py) 地址: Unix socket 路径, 或 host:port
+SERVICE_ADDRESS = os.environ.get("CYCLE_SERVICE", "cycle_data.sock" if hasattr(socket, "AF_UNIX") else "127.0.0.1:8765")
+
+# 服务协议没有账号体系: 用共享密钥认证每个连接, 密钥文件只对当前用户可读写 (0600), 由数据服务首次启动时生成
+SERVICE_TOKEN_FILE = os.environ.get("CYCLE_SERVICE_TOKEN", "cycle_data.token")
+MAX_FRAME = int(os.environ.get("CYCLE_SERVICE_MAX_FRAME", 256 * 2 ** 20))
+AUTH_FRAME = 1024  # 认证前只接受这么大的帧
+
+def service_token(create=False, path=None):
+    path = path or SERVICE_TOKEN_FILE
+    if create:
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-        except: return {"users": {}}
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as f: f.write(os.urandom(32).hex())
+        except FileExistsError: pass
+    try:
+        with open(path, encoding="utf-8") as f: return f.read().strip()
+    except OSError as e: raise StorageError(f"无法读取数据服务密钥 {path}: {e}") from e
+
+def parse_address(address):
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address: return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            if not buf: return None
+            raise ConnectionError("数据服务连接中断")
+        buf += chunk
+    return bytes(buf)
+
+def send_frame(sock, obj):
+    # 4 字节长度前缀 + JSON
+    data = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+    sock.sendall(struct.pack("!I", len(data)) + data)
+    return len(data)
+
+def recv_frame(sock, limit=MAX_FRAME):
+    head = _recv_exact(sock, 4)
+    if head is None: return None
+    n = struct.unpack("!I", head)[0]
+    if n > limit: raise ValueError(f"数据帧过大: {n} 字节")
+    return json.loads(_recv_exact(sock, n))
+
+class RemoteBackend:
+    # 通过本地数据服务读写 (CYCLE_STORAGE=remote): 服务进程独占存储并做内存缓存, 多个 Streamlit 进程各自用一个连接池访问
+    ERRORS = {"VersionConflict": VersionConflict, "StorageError": StorageError, "ValueError": ValueError}
+    PAGE = 500
+
+    def __init__(self, address=None, pool_size=8, token=None):
+        self.address = address or SERVICE_ADDRESS
+        self.family, self.target = parse_address(self.address)
+        self.pool = queue.LifoQueue(pool_size)
+        self.token = token
+
+    def _connect(self):
+        # 新连接先发送共享密钥, 服务端认证通过后才处理请求
+        self.token = self.token or service_token()
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.target)
+            if self.family == socket.AF_INET: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_frame(sock, ["auth", [self.token]])
+            resp = recv_frame(sock)
+        except BaseException: sock.close(); raise
+        if not resp or "error" in resp: sock.close(); raise StorageError("数据服务认证失败 (密钥不一致?)")
+        return sock
+
+    def call(self, op, *args):
+        # 池里的连接可能已被服务端关闭 (服务重启): 发送失败时换新连接重试一次
+        for attempt in range(2):
+            try: sock, pooled = self.pool.get_nowait(), True
+            except queue.Empty: sock, pooled = self._connect(), False
+            try:
+                send_frame(sock, [op, args])
+                resp = recv_frame(sock)
+                if resp is None: raise ConnectionError("数据服务连接中断")
+            except OSError:
+                sock.close()
+                if pooled and not attempt: continue
+                raise
+            try: self.pool.put_nowait(sock)
+            except queue.Full: sock.close()
+            if "error" in resp: raise self.ERRORS.get(resp["error"], StorageError)(resp["message"])
+            return resp["result"]
+
+    def close(self):
+        while not self.pool.empty(): self.pool.get_nowait().close()
+
+    def version_token(self): return self.call("version_token")
+    @Profiler.timed("remote.get_user")
+    def get_user(self, username): return self.call("get_user", username)
+    @Profiler.timed("remote.get_meta")
+    def get_meta(self, username): return self.call("get_meta", username)
+    def usernames(self): return self.call("usernames")
+    def user_token(self, username): return self.call("user_token", username)
+
+    def _pages(self, op):
+        after = ""
+        while True:
+            page = self.call(op, after, self.PAGE)
+            yield from page
+            if len(page) < self.PAGE: return
+            after = page[-1][0]
+    def iter_users(self): return self._pages("user_page")
+    def iter_meta(self): return self._pages("meta_page")
+
+    def create_user(self, username, record): return self.call("create_user", username, record)
+    # 数据服务不下发全部密码哈希 (凭据索引对 remote 从空开始, 登录时经 get_credential 逐个补进)
+    def load_credentials(self): raise StorageError("remote 后端不支持读取全部凭据")
+    def get_credential(self, username): return self.call("get_credential", username)
+    def set_credential(self, username, h): return self.call("set_credential", username, h)
+
+    @Profiler.timed("remote.save_meta")
+    def save_meta(self, username, meta, base_rev=None): self.call("save_meta", username, meta, base_rev)
+    @Profiler.timed("remote.save_log")
+    def save_log(self, username, day, entry, meta=None, base_rev=None): self.call("save_log", username, day, entry, meta, base_rev)
+    def save_logs(self, username, logs, meta=None, base_rev=None): self.call("save_logs", username, logs, meta, base_rev)
+    # 整库读写不经过数据服务, 请在服务所在机器上直接对存储运行 (如 backup.py)
+    def load_all(self): raise StorageError("remote 后端不支持整库读取")
+    def save_all(self, data): raise StorageError("remote 后端不支持整库写入")
+
+# 变更日志: 每次写入成功后追加一条小记录 (不含可重建的派生字段) 到只追加的日志段; 定期写压缩快照并清理旧段, 可按时间点恢复
+JOURNAL_ENABLED = os.environ.get("CYCLE_JOURNAL", "1") != "0"
+
+class Journal:
+    # 目录布局: snapshot-<序号>_<时间>.json.gz (该序号时的全量数据) + journal-<起始序号>.jsonl (快照之后的变更, 每行一条)
+    DERIVED = ("rollups", "rollups_ver", "cycle_stats", "daily", "prediction")  # 读取时会自动重建, 不写进变更记录
+    SNAPSHOT_EVERY = 5000   # 距上个快照累计这么多条记录后, maybe_snapshot 才真正写快照
+    KEEP_SNAPSHOTS = 5      # 可恢复的范围: 最早保留的快照之后的任意时间点
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lock = FileLock(os.path.join(path, "journal.lock"))
+        self._tail_cache = (None, None, None)  # (段文件, 文件大小, 最后序号): 其他进程追加后大小会变, 再重读
+
+    def _file(self, name): return os.path.join(self.path, name)
+
+    def segments(self):
+        return sorted((int(f[8:-6]), f) for f in os.listdir(self.path) if f.startswith("journal-") and f.endswith(".jsonl"))
+
+    def snapshots(self):
+        out = []
+        for f in os.listdir(self.path):
+            if f.startswith("snapshot-") and f.endswith(".json.gz"):
+                seq, ts = f[9:-8].split("_")
+                out.append((int(seq), datetime.strptime(ts, "%Y%m%dT%H%M%S"), f))
+        return sorted(out)
+
+    @staticmethod
+    def _last_seq(path, size):
+        # 从文件末尾往前找最后一条完整记录; 崩溃时写了一半的行跳过
+        window = 4096
+        with open(path, "rb") as f:
+            while True:
+                f.seek(max(0, size - window)); lines = f.read().splitlines()
+                for line in reversed(lines if window >= size else lines[1:]):
+                    try: return json.loads(line)["seq"]
+                    except ValueError: continue
+                if window >= size: return None
+                window *= 4
+
+    def _tail(self):
+        # (当前段文件或 None 表示需要新开一段, 最后序号); 调用方持有 self.lock
+        snaps, segs = self.snapshots(), self.segments()
+        snap_seq = snaps[-1][0] if snaps else 0
+        if not segs: return None, snap_seq
+        start, name = segs[-1]
+        size = os.path.getsize(self._file(name))
+        seg, cached_size, seq = self._tail_cache
+        if (seg, cached_size) != (name, size):
+            seq = self._last_seq(self._file(name), size) if size else None
+            seq = start - 1 if seq is None else seq
+            self._tail_cache = (name, size, seq)
+        # 快照之后的记录写进新的段, 这样清理时整段删除
+        return (None, seq) if snap_seq >= seq else (name, seq)
+
+    def append(self, records):
+        # 调用方持有 self.lock (与存储写入在同一把锁内, 多进程写入时记录顺序与存储一致)
+        if not records: return
+        seg, seq = self._tail()
+        if seg is None: seg = f"journal-{seq + 1:012d}.jsonl"
+        ts = datetime.now().isoformat(timespec="seconds")
+        lines = []
+        for r in records:
+            seq += 1
+            lines.append(json.dumps({"seq": seq, "ts": ts, **r}, ensure_ascii=False, separators=(",", ":")))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        path = self._file(seg)
+        with open(path, "ab+") as f:
+            # 上次崩溃留下没有换行的半行: 先补换行, 新记录从新的一行开始
+            if f.seek(0, os.SEEK_END) and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n": f.write(b"\n")
+            f.write(payload)
+            size = f.tell()
+        Profiler.add_bytes(written=len(payload))
+        self._tail_cache = (seg, size, seq)
+
+    @classmethod
+    def strip(cls, record):
+        return {k: v for k, v in record.items() if k not in cls.DERIVED}
+
+    # ---- 快照与清理 ----
+    def snapshot(self, backend, keep=KEEP_SNAPSHOTS):
+        # 在日志锁内读全量数据, 保证快照和序号对应; 写临时文件后原子替换
+        with self.lock:
+            seq = self._tail()[1]
+            snaps = self.snapshots()
+            if snaps and snaps[-1][0] == seq: return seq
+            data = backend.load_all()
+            name = f"snapshot-{seq:012d}_{datetime.now():%Y%m%dT%H%M%S}.json.gz"
+            tmp = self._file(f"{name}.{os.getpid()}.tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f: json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self._file(name))
+            self.compact(keep)
+            return seq
+
+    def maybe_snapshot(self, backend, every=SNAPSHOT_EVERY):
+        with self.lock:
+            snaps = self.snapshots()
+            if snaps and self._tail()[1] - snaps[-1][0] < every: return None
+            return self.snapshot(backend)
+
+    def compact(self, keep=KEEP_SNAPSHOTS):
+        # 只保留最近 keep 个快照; 完全落在最早保留快照之前的日志段整段删除
+        with self.lock:
+            snaps = self.snapshots()
+            for _, _, f in snaps[:-max(1, keep)]: os.remove(self._file(f))
+            if not snaps: return
+            oldest = snaps[-max(1, keep):][0][0]
+            segs = self.segments()
+            for (_, f), (nxt, _) in zip(segs, segs[1:]):
+                if nxt <= oldest + 1: os.remove(self._file(f))
+
+    # ---- 重放与按时间点恢复 ----
+    def load_snapshot(self, seq):
+        for s, _, f in self.snapshots():
+            if s == seq:
+                with gzip.open(self._file(f), "rt", encoding="utf-8") as fh: return json.load(fh)
+        raise StorageError(f"快照不存在: {seq}")
+
+    def records(self, after=0):
+        segs = self.segments()
+        for i, (start, f) in enumerate(segs):
+            if i + 1 < len(segs) and segs[i + 1][0] <= after + 1: continue
+            with open(self._file(f), encoding="utf-8") as fh:
+                for line in fh:
+                    try: r = json.loads(line)
+                    except ValueError: continue
+                    if r["seq"] > after: yield r
+
+    @classmethod
+    def apply(cls, data, r):
+        users, u, op = data["users"], r.get("user"), r["op"]
+        if op == "create": users.setdefault(u, r["record"])
+        elif op == "cred":
+            if u in users: users[u]["password"] = r["hash"]
+        elif op == "put":
+            cur = users.get(u) or {"cycle_data": {}}
+            rec = cls.strip(r["meta"] if r.get("meta") is not None else cur)
+            if "password" in cur: rec["password"] = cur["password"]
+            rec["cycle_data"] = {**rec.get("cycle_data", {}), "logs": {**cur["cycle_data"].get("logs", {}), **r["logs"]}}
+            users[u] = rec
+
+    def state_at(self, at=None, seq=None):
+        # 时间点 at (datetime) / 序号 seq 时的全量数据: 不晚于该点的最近快照 + 重放其后的记录
+        ok = lambda s, ts: (seq is None or s <= seq) and (at is None or ts <= at)
+        snaps = [s for s in self.snapshots() if ok(s[0], s[1])]
+        if not snaps: raise StorageError("早于最早保留的快照, 无法恢复到该时间点")
+        base = snaps[-1][0]
+        data, last = self.load_snapshot(base), base
+        for r in self.records(base):
+            if seq is not None and r["seq"] > seq: break
+            if at is not None and datetime.fromisoformat(r["ts"]) > at: continue
+            # save_all/恢复 整体替换: 同一序号上有对应快照
+            if r["op"] == "all": data = self.load_snapshot(r["seq"])
+            else: self.apply(data, r)
+            last = r["seq"]
+        return data, last
+
+class JournaledBackend:
+    # 包装任意存储后端: 写入在日志锁内执行, 成功后追加变更记录; 读取直接转发
+    def __init__(self, backend, journal):
+        self.backend, self.journal = backend, journal
+        if not journal.snapshots(): journal.snapshot(backend)  # 首次启用: 先给现有数据做一个基准快照
+
+    def __getattr__(self, name): return getattr(self.backend, name)
+
+    @staticmethod
+    def _put(username, meta, logs):
+        m = None
+        if meta is not None: m = Journal.strip(split_user_record(meta)[0]); m.pop("password", None)
+        return {"op": "put", "user": username, "meta": m, "logs": logs}
+
+    def _write(self, record, fn, *args):
+        with self.journal.lock:
+            result = fn(*args)
+            self.journal.append([record])
+        return result
+
+    def save_meta(self, username, meta, base_rev=None):
+        self._write(self._put(username, meta, {}), self.backend.save_meta, username, meta, base_rev)
+    def save_log(self, username, day, entry, meta=None, base_rev=None):
+        self._write(self._put(username, meta, {day: entry}), self.backend.save_log, username, day, entry, meta, base_rev)
+    def save_logs(self, username, logs, meta=None, base_rev=None):
+        self._write(self._put(username, meta, logs), self.backend.save_logs, username, logs, meta, base_rev)
+    def set_credential(self, username, h):
+        self._write({"op": "cred", "user": username, "hash": h}, self.backend.set_credential, username, h)
+
+    def create_user(self, username, record):
+        with self.journal.lock:
+            ok = self.backend.create_user(username, record)
+            if ok: self.journal.append([{"op": "create", "user": username, "record": Journal.strip(record)}])
+        return ok
+
+    def write_batch(self, items):
+        with self.journal.lock:
+            errors = self.backend.write_batch(items)
+            self.journal.append([self._put(*item[:3]) for item, err in zip(items, errors) if err is None])
+        return errors
+
+    def save_all(self, data):
+        # 整体替换不逐条记录: 记一个标记, 紧接着在同一序号上写快照
+        with self.journal.lock:
+            self.backend.save_all(data)
+            self.journal.append([{"op": "all"}])
+            self.journal.snapshot(self.backend)
+
+class DataManager:
+    _backend = None
+
+    @staticmethod
+    def create_backend(kind=None):
+        # 本地后端默认带变更日志 (<数据文件>.history/); remote 由数据服务进程记录
+        kind = kind or STORAGE_BACKEND
+        if kind == "remote": return RemoteBackend()
+        if kind == "json": backend, path = JsonFileBackend(DATA_FILE), DATA_FILE
+        elif kind == "sqlite":
+            backend, path = SQLiteBackend(DB_FILE), DB_FILE
+            backend.import_json(DATA_FILE)
+        else: raise ValueError(f"未知存储后端: {kind}")
+        return JournaledBackend(backend, Journal(f"{path}.history")) if JOURNAL_ENABLED else backend
+
+    @staticmethod
+    @st.cache_resource(show_spinner=False)
+    def shared_backend(kind):
+        # 脚本每次 rerun 都会重新执行, 用 cache_resource 让连接在进程内跨 rerun/会话共享
+        return DataManager.create_backend(kind)
+
+    @classmethod
+    def backend(cls):
+        if cls._backend is None: cls._backend = cls.shared_backend(STORAGE_BACKEND)
+        return cls._backend
+
+    @classmethod
+    def use(cls, backend): cls._backend = backend
+
+    @staticmethod
+    def load_all_data(): return DataManager.backend().load_all()
 
     @staticmethod
     def save_all_data(data):
-        try:
-            with open(DATA_FILE, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False, indent=4)
+        try: DataManager.backend().save_all(data)
         except Exception as e: st.error(f"保存失败: {e}")
 
+    @staticmethod
+    def load_user(username): return DataManager.backend().get_user(username)
+    @staticmethod
+    def load_meta(username): return DataManager.backend().get_meta(username)
+    @staticmethod
+    def iter_users(): return DataManager.backend().iter_users()
+    @staticmethod
+    def iter_meta(): return DataManager.backend().iter_meta()
+    @staticmethod
+    def create_user(username, record): return DataManager.backend().create_user(username, record)
+
+    @staticmethod
+    def save_meta(username, user, base_rev=None):
+        try: DataManager.backend().save_meta(username, user, base_rev); return True
+        except VersionConflict: raise
+        except Exception as e: st.error(f"保存失败: {e}"); return False
+
+    @staticmethod
+    def save_log(username, day, entry, meta=None, base_rev=None):
+        try: DataManager.backend().save_log(username, day, entry, meta, base_rev); return True
+        except VersionConflict: raise
+        except Exception as e: st.error(f"保存失败: {e}"); return False
+
+class UserCache:
+    # 会话级缓存: 跨 rerun 保留解析好的用户记录, 只在该用户的版本 (backend.user_token) 变化时失效
+    MAX_RETRIES = 5
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    @staticmethod
+    def session():
+        if "_user_cache" not in st.session_state: st.session_state._user_cache = UserCache()
+        return st.session_state._user_cache
+
+    def get(self, username):
+        token = DataManager.backend().user_token(username)
+        entry = self.entries.get(username)
+        if entry is not None and entry[0] == token:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        user = DataManager.load_user(username)
+        self.entries[username] = (token, user, {})
+        return user
+
+    def derived(self, username, name, factory):
+        # 基于当前记录构建的派生结构 (索引等), 记录重新加载时一起丢弃, 写入时增量更新
+        entry = self.entries.get(username)
+        if entry is None: return factory(self.get(username))
+        if name not in entry[2]: entry[2][name] = factory(entry[1])
+        return entry[2][name]
+
+    def _write_through(self, username, user, ok):
+        # 写入成功: 内存里的记录就是最新的, 只需刷新版本号; 失败则丢弃
+        entry = self.entries.get(username)
+        if ok: self.entries[username] = (DataManager.backend().user_token(username), user, entry[2] if entry else {})
+        else: self.invalidate(username)
+        return ok
+
+    def _commit(self, username, user, mutate, write):
+        # 乐观并发: 在读到的版本上执行 mutate, 按 rev 比较并写入; 被其他会话抢先时重新加载最新记录并重放 mutate
+        for attempt in range(self.MAX_RETRIES):
+            if attempt: time.sleep(random.uniform(0, 0.005 * attempt))
+            base = user.get("rev", 0)
+            result = mutate(user)
+            user["rev"] = base + 1
+            DailySnapshot.refresh(user)
+            try: ok = write(user, base)
+            except VersionConflict:
+                self.conflicts += 1
+                self.invalidate(username)
+                user = DataManager.load_user(username)
+                continue
+            return self._write_through(username, user, ok), result
+        self.invalidate(username)
+        st.error("保存失败: 数据正在被其他页面修改, 请重试")
+        return False, None
+
+    def save_meta(self, username, user, mutate):
+        return self._commit(username, user, mutate, lambda u, base: DataManager.save_meta(username, u, base))[0]
+
+    def save_log(self, username, user, day, log):
+        def mutate(u):
+            c_data = u["cycle_data"]
+            old = c_data["logs"].get(day)
+            AnalyticsEngine.update(u, day, old, log)  # 先于写入 logs: 没有汇总的旧记录会按现有日志重建
+            c_data["logs"][day] = log
+            return old
+        ok, old = self._commit(username, user, mutate, lambda u, base: DataManager.save_log(username, day, log, u, base))
+        if ok:
+            for index in self.entries[username][2].values(): index.update(day, old, log)
+        return ok
+
+    def invalidate(self, username=None):
+        if username is None: self.entries.clear()
+        else: self.entries.pop(username, None)
+
+    def stats(self): return {"hits": self.hits, "misses": self.misses, "conflicts": self.conflicts, "users": len(self.entries)}
+
+class CredentialIndex:
+    # 账号 -> 密码哈希 的小索引: 挂在进程共享的存储后端上, 只加载一次, 登录不再读取用户元数据或日志
+    @classmethod
+    def _state(cls):
+        backend = DataManager.backend()
+        s = getattr(backend, "_credential_index", None)
+        if s is None:
+            s = {"hashes": {} if isinstance(backend, RemoteBackend) else backend.load_credentials(), "lock": threading.Lock()}
+            backend._credential_index = s
+        return backend, s
+
+    @classmethod
+    def get(cls, username):
+        backend, s = cls._state()
+        h = s["hashes"].get(username)
+        if h is None:
+            # 可能是其他进程刚注册的账号: 单行查询后补进索引
+            h = backend.get_credential(username)
+            if h is not None:
+                with s["lock"]: s["hashes"][username] = h
+        return h
+
+    @classmethod
+    def put(cls, username, h):
+        backend, s = cls._state()
+        backend.set_credential(username, h)
+        with s["lock"]: s["hashes"][username] = h
+
+    @classmethod
+    def added(cls, username, h):
+        _, s = cls._state()
+        with s["lock"]: s["hashes"][username] = h
+
 class AuthSystem:
+    # 密码哈希格式: scrypt$n$r$p$salt$hash 或 pbkdf2_sha256$iterations$salt$hash; 64 位十六进制为旧版无盐 SHA-256
+    KDF = os.environ.get("CYCLE_KDF", "scrypt")
+    SCRYPT_N = int(os.environ.get("CYCLE_SCRYPT_N", 2 ** 14))
+    SCRYPT_R, SCRYPT_P = 8, 1
+    PBKDF2_ITERATIONS = int(os.environ.get("CYCLE_PBKDF2_ITERATIONS", 600_000))
+
     @staticmethod
-    def make_hashes(p): return hashlib.sha256(str.encode(p)).hexdigest()
+    def legacy_hash(p): return hashlib.sha256(str.encode(p)).hexdigest()
+
     @staticmethod
-    def check_hashes(p, h): return AuthSystem.make_hashes(p) == h
+    def _b64(b): return base64.b64encode(b).decode()
+
+    @staticmethod
+    def make_hashes(p, salt=None):
+        salt = salt or os.urandom(16)
+        if AuthSystem.KDF == "pbkdf2":
+            n = AuthSystem.PBKDF2_ITERATIONS
+            dk = hashlib.pbkdf2_hmac("sha256", p.encode(), salt, n)
+            return f"pbkdf2_sha256${n}${AuthSystem._b64(salt)}${AuthSystem._b64(dk)}"
+        n, r, q = AuthSystem.SCRYPT_N, AuthSystem.SCRYPT_R, AuthSystem.SCRYPT_P
+        dk = hashlib.scrypt(p.encode(), salt=salt, n=n, r=r, p=q, maxmem=256 * n * r, dklen=32)
+        return f"scrypt${n}${r}${q}${AuthSystem._b64(salt)}${AuthSystem._b64(dk)}"
+
+    @staticmethod
+    def check_hashes(p, h):
+        parts = h.split("$")
+        if parts[0] == "scrypt" and len(parts) == 6:
+            n, r, q = int(parts[1]), int(parts[2]), int(parts[3])
+            dk = hashlib.scrypt(p.encode(), salt=base64.b64decode(parts[4]), n=n, r=r, p=q, maxmem=256 * n * r, dklen=32)
+            return hmac.compare_digest(dk, base64.b64decode(parts[5]))
+        if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            dk = hashlib.pbkdf2_hmac("sha256", p.encode(), base64.b64decode(parts[2]), int(parts[1]))
+            return hmac.compare_digest(dk, base64.b64decode(parts[3]))
+        return hmac.compare_digest(AuthSystem.legacy_hash(p), h)
+
+    @staticmethod
+    def needs_upgrade(h):
+        if AuthSystem.KDF == "pbkdf2": return not h.startswith(f"pbkdf2_sha256${AuthSystem.PBKDF2_ITERATIONS}$")
+        return not h.startswith(f"scrypt${AuthSystem.SCRYPT_N}${AuthSystem.SCRYPT_R}${AuthSystem.SCRYPT_P}$")
+
     @staticmethod
     def login(u, p):
-        d = DataManager.load_all_data()
-        if u not in d["users"]: return False
-        return AuthSystem.check_hashes(p, d["users"][u]["password"])
+        # 在当前会话的脚本线程里直接计算: hashlib 的 scrypt/pbkdf2 计算期间释放 GIL, 其他会话照常运行; 本会话等待属正常 (有 spinner)
+        h = CredentialIndex.get(u)
+        if h is None or not AuthSystem.check_hashes(p, h): return False
+        # 旧版 SHA-256 (或参数过时的) 哈希在登录成功后透明升级
+        if AuthSystem.needs_upgrade(h): CredentialIndex.put(u, AuthSystem.make_hashes(p))
+        return True
+
     @staticmethod
     def register(u, p):
-        d = DataManager.load_all_data()
-        if u in d["users"]: return False
-        d["users"][u] = {"password": AuthSystem.make_hashes(p), "profile": {"age": 25}, "cycle_data": {"dates": [], "logs": {}}}
-        DataManager.save_all_data(d)
+        h = AuthSystem.make_hashes(p)
+        if not DataManager.create_user(u, new_user_record(h)): return False
+        CredentialIndex.added(u, h)
         return True
 
 # ==========================================
@@ -232,6 +1194,19 @@ class MedicalEngine:
         "NUTRITION": "Am J Clin Nutr. (2016). 'Energy Balance'.",
         "ENERGY_STUDY": "J Psychosom Res. (2000). 'Menstrual cycle and voluntary physical activity'."
     }
+
+    NEG_MOODS = ["焦虑", "易怒", "悲伤", "疲惫", "内耗", "想哭", "甚至想死"]
+
+    # 建议规则: phases/moods/symptoms/habits 为"任一命中", 省略即不限; primary 规则按 priority 取最高的一条, note 规则全部附加到 {notes}
+    RULES = [
+        {"id": "pms", "kind": "primary", "priority": 100, "title": "PMS 风险", "phases": ["luteal"], "moods": NEG_MOODS,
+         "diagnosis": "⚠️ **PMS 风险**", "mechanism": "雌激素骤降影响血清素。", "diet": "补充镁、维生素B6。", "lifestyle": "增加光照，轻瑜伽。", "citation": "ACOG_PMS"},
+        {"id": "default", "kind": "primary", "priority": 0,
+         "diagnosis": "当前处于 {phase}", "mechanism": "激素水平波动正常。", "diet": "保持均衡饮食。", "lifestyle": "规律作息。{notes}", "citation": "WHO_FP"},
+        {"id": "painkiller", "kind": "note", "habits": ["💊 止痛药"], "text": "已记录服药，建议不要空腹服用。"},
+        {"id": "caffeine_luteal", "kind": "note", "phases": ["luteal"], "habits": ["☕ 咖啡因"], "text": "黄体期摄入咖啡因可能加重焦虑。"},
+        {"id": "late_night", "kind": "note", "habits": ["🦉 熬夜"], "text": "注意补觉，熬夜会影响激素平衡。"},
+    ]
     
     EMOJI_MAP = {
         "开心": "😆", "自信": "💃", "平静": "🍃", "能量满格": "🔋", "被爱": "🥰", "感恩": "🙏", "高效": "💪",
@@ -264,6 +1239,8 @@ class MedicalEngine:
         "你的光芒，独一无二。🌟", "允许自己休息，也是一种能力。💤", "今天的你，也很棒！👍"
     ]
 
+    PHASE_NAMES = {"menstrual": "月经期", "follicular": "卵泡期", "ovulatory": "排卵期", "luteal": "黄体期"}
+
     def __init__(self, age): self.age = age
     def get_random_message(self): return random.choice(self.WARM_MESSAGES)
     def determine_phase(self, day, cycle_len):
@@ -273,53 +1250,564 @@ class MedicalEngine:
         elif day <= (ovulation + 2): return "排卵期 (Ovulatory)", "ovulatory"
         elif day <= cycle_len: return "黄体期 (Luteal)", "luteal"
         else: return "周期推迟 (Delayed)", "luteal"
+
+    PHASE_KEYS = ("menstrual", "follicular", "ovulatory", "luteal", "")
+
+    @staticmethod
+    @functools.cache
+    def phase_keys(): return np.array(MedicalEngine.PHASE_KEYS)
+
+    @classmethod
+    def determine_phases(cls, days, cycle_len):
+        # determine_phase 的向量版: 一次 np.select 处理任意多天, cycle_len 可为标量或同形数组; 第 0 天及之前为 ""
+        days = np.asarray(days)
+        ovulation = np.asarray(cycle_len) - 14
+        idx = np.select([days < 1, days <= 5, days < (ovulation - 2), days <= (ovulation + 2)], [4, 0, 1, 2], default=3)
+        return cls.phase_keys()[idx]
+
+    @classmethod
+    def phases_for_range(cls, start, end, period_dates, cycle_len, today=None):
+        # [start, end] 内每天的阶段: 用 searchsorted 找到各自所属的经期; 今天之后超出周期的日子按平均周期向后推算
+        days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+        starts = np.array(sorted(period_dates), dtype="datetime64[D]")
+        if not starts.size: return days, np.full(days.shape, "", dtype=cls.phase_keys().dtype)
+        i = np.searchsorted(starts, days, side="right") - 1
+        delta = (days - starts[np.maximum(i, 0)]).astype(np.int64)
+        future = (days > np.datetime64(today or date.today(), "D")) & (delta >= cycle_len)
+        delta = np.where(future, delta % cycle_len, delta)
+        return days, cls.determine_phases(np.where(i < 0, 0, delta + 1), cycle_len)
+
     def get_pet_status(self, phase_key): return self.PET_STATUS.get(phase_key, self.PET_STATUS["menstrual"])
 
+    @Profiler.timed("medical.generate_report")
     def generate_report(self, phase, symptoms, primary_mood, secondary_moods, bbt, meds):
-        p_mood = primary_mood if primary_mood is not None else "无"
-        s_moods = secondary_moods if secondary_moods is not None else []
-        meds_list = meds if meds is not None else []
-        
-        report = {"diagnosis": "", "mechanism": "", "diet": "", "lifestyle": "", "citation": ""}
-        all_moods = [p_mood] + s_moods
-        neg_moods = [m for m in all_moods if m in ["焦虑", "易怒", "悲伤", "疲惫", "内耗", "想哭", "甚至想死"]]
-        
-        med_feedback = []
-        if "💊 止痛药" in meds_list: med_feedback.append("已记录服药，建议不要空腹服用。")
-        if "☕ 咖啡因" in meds_list and phase == "luteal": med_feedback.append("黄体期摄入咖啡因可能加重焦虑。")
-        if "🦉 熬夜" in meds_list: med_feedback.append("注意补觉，熬夜会影响激素平衡。")
-        med_feedback_str = " ".join(med_feedback)
-        
-        if phase == "luteal" and neg_moods:
-            report["diagnosis"] = "⚠️ **PMS 风险**"
-            report["mechanism"] = "雌激素骤降影响血清素。"
-            report["diet"] = "补充镁、维生素B6。"
-            report["lifestyle"] = "增加光照，轻瑜伽。"
-            report["citation"] = self.MEDICAL_DB['ACOG_PMS']
-        else:
-            report["diagnosis"] = f"当前处于 {phase}"
-            report["mechanism"] = "激素水平波动正常。"
-            report["diet"] = "保持均衡饮食。"
-            report["lifestyle"] = f"规律作息。{med_feedback_str}"
-            report["citation"] = self.MEDICAL_DB['WHO_FP']
-        return report
+        moods = [primary_mood or "无"] + list(secondary_moods or [])
+        return RuleEngine.evaluate(phase, moods, symptoms or [], meds or [])
+
+# ==========================================
+# 🗜️ 紧凑日志表示
+# ==========================================
+class LogCodec:
+    # 选项词表 -> 位编码; 词表顺序就是位序, 只能在末尾追加
+    MOODS = [m for m in MedicalEngine.EMOJI_MAP if m != "无"]
+    SYMPTOMS = [s for s in MedicalEngine.SYMPTOMS_OPTIONS if s != "无"]
+    HABITS = [h for h in MedicalEngine.HABITS_OPTIONS if h != "无"]
+    PHASES = ["menstrual", "follicular", "ovulatory", "luteal"]
+    MOOD_IDX = {m: i for i, m in enumerate(MOODS)}
+    SYMPTOM_IDX = {s: i for i, s in enumerate(SYMPTOMS)}
+    HABIT_IDX = {h: i for i, h in enumerate(HABITS)}
+    PHASE_IDX = {p: i for i, p in enumerate(PHASES)}
+    KEYS = {"primary_mood", "secondary_moods", "energy", "symptoms", "meds", "note", "phase"}
+
+    @staticmethod
+    def mask(values, index):
+        # 选项列表 -> 位图; 忽略词表之外的值 (如 "无")
+        bits = 0
+        for v in values:
+            i = index.get(v)
+            if i is not None: bits |= 1 << i
+        return bits
+
+# ==========================================
+# 🧭 建议规则引擎
+# ==========================================
+class RuleEngine:
+    # MedicalEngine.RULES 编译成位图索引: 规则按优先级排好后第 i 条对应第 i 位, 每个阶段/选项记录"允许它的规则集合";
+    # 一条日志的匹配结果 = 阶段集合 & 各维度 (不限该维度的规则 | 日志中各选项对应的规则) 的按位与, 规则再多也只是几次整数运算
+    DIMS = (("moods", LogCodec.MOOD_IDX, LogCodec.MOODS), ("symptoms", LogCodec.SYMPTOM_IDX, LogCodec.SYMPTOMS), ("habits", LogCodec.HABIT_IDX, LogCodec.HABITS))
+
+    @staticmethod
+    def compile(rules):
+        rules = sorted(rules, key=lambda r: -r.get("priority", 0))
+        c = {"rules": rules, "phase": {p: 0 for p in LogCodec.PHASES}, "phase_free": 0, "primary": 0, "conditional": 0,
+             "free": [0] * len(RuleEngine.DIMS), "opt": [[0] * len(vocab) for _, _, vocab in RuleEngine.DIMS]}
+        for i, r in enumerate(rules):
+            bit = 1 << i
+            if r["kind"] == "primary": c["primary"] |= bit
+            if "phases" in r:
+                for p in r["phases"]: c["phase"][p] |= bit
+            else: c["phase_free"] |= bit
+            for d, (name, index, _) in enumerate(RuleEngine.DIMS):
+                if name in r:
+                    for v in r[name]: c["opt"][d][index[v]] |= bit
+                else: c["free"][d] |= bit
+            if any(k in r for k in ("phases", "moods", "symptoms", "habits")): c["conditional"] |= bit
+        for p in c["phase"]: c["phase"][p] |= c["phase_free"]
+        return c
+
+    @staticmethod
+    @st.cache_resource(show_spinner=False)
+    def compiled(): return RuleEngine.compile(MedicalEngine.RULES)
+
+    @staticmethod
+    def match(c, phase, masks):
+        # masks: (情绪, 症状, 习惯) 位图; 返回命中规则的位集合
+        m = c["phase"].get(phase, c["phase_free"])
+        for d, mask in enumerate(masks):
+            hit, opt, rest = c["free"][d], c["opt"][d], mask
+            while rest:
+                low = rest & -rest
+                hit |= opt[low.bit_length() - 1]
+                rest ^= low
+            m &= hit
+        return m
+
+    @staticmethod
+    def masks(moods, symptoms, habits):
+        return (LogCodec.mask(moods, LogCodec.MOOD_IDX), LogCodec.mask(symptoms, LogCodec.SYMPTOM_IDX), LogCodec.mask(habits, LogCodec.HABIT_IDX))
+
+    @staticmethod
+    def rules_of(c, bits):
+        out = []
+        while bits:
+            low = bits & -bits
+            out.append(c["rules"][low.bit_length() - 1])
+            bits ^= low
+        return out
+
+    @staticmethod
+    def evaluate(phase, moods, symptoms, habits):
+        c = RuleEngine.compiled()
+        m = RuleEngine.match(c, phase, RuleEngine.masks(moods, symptoms, habits))
+        notes = " ".join(r["text"] for r in RuleEngine.rules_of(c, m & ~c["primary"]))
+        primary = m & c["primary"]
+        if not primary: return {"diagnosis": "", "mechanism": "", "diet": "", "lifestyle": notes, "citation": ""}
+        r = RuleEngine.rules_of(c, primary & -primary)[0]
+        fmt = lambda s: s.format(phase=phase, notes=notes)
+        return {"diagnosis": fmt(r["diagnosis"]), "mechanism": r["mechanism"], "diet": r["diet"], "lifestyle": fmt(r["lifestyle"]),
+                "citation": MedicalEngine.MEDICAL_DB[r["citation"]]}
+
+    @staticmethod
+    @Profiler.timed("rules.batch")
+    def batch(logs):
+        # 全部历史日志批量匹配: 同样的 (阶段, 选项组合) 只算一次; 返回 {规则 id: 命中天数}, 不含无条件的默认规则
+        c = RuleEngine.compiled()
+        memo, counts = {}, {}
+        for entry in logs.values():
+            if not entry: continue
+            key = (entry.get("phase", ""),) + RuleEngine.masks(AnalyticsEngine.entry_moods(entry), entry.get("symptoms", []), entry.get("meds", []))
+            m = memo.get(key)
+            if m is None:
+                m = RuleEngine.match(c, key[0], key[1:])
+                primary = m & c["primary"]
+                m = memo[key] = (m & ~c["primary"] | primary & -primary) & c["conditional"]
+            while m:
+                low = m & -m
+                rid = c["rules"][low.bit_length() - 1]["id"]
+                counts[rid] = counts.get(rid, 0) + 1
+                m ^= low
+        return counts
+
+# ==========================================
+# 📊 周期统计 (增量维护)
+# ==========================================
+class CycleStats:
+    # 只保存累计值 (有效间隔数/总天数/最后一次经期), 每次渲染 O(1); 日期增删时按相邻日期增量更新
+    MIN_GAP, MAX_GAP = 15, 60
+    DEFAULT_LEN = 28
+
+    def __init__(self, count=0, total=0, n_dates=0, last=None, version=0):
+        self.count = count
+        self.total = total
+        self.n_dates = n_dates
+        self.last = last
+        self.version = version  # 每次增删日期 +1
+
+    @classmethod
+    def _gap(cls, a, b):
+        d = (date.fromisoformat(b) - date.fromisoformat(a)).days
+        return d if cls.MIN_GAP < d < cls.MAX_GAP else None
+
+    def _apply(self, a, b, sign):
+        if a is None or b is None: return
+        g = self._gap(a, b)
+        if g is not None: self.count += sign; self.total += sign * g
+
+    @classmethod
+    def from_dates(cls, dates):
+        s = cls()
+        for i, d in enumerate(dates):
+            if i: s._apply(dates[i-1], d, 1)
+        s.n_dates = len(dates)
+        s.last = dates[-1] if dates else None
+        return s
+
+    @classmethod
+    def for_user(cls, user):
+        # 旧数据没有统计值: 排序去重后重建一次, 之后随记录一起保存
+        c_data = user["cycle_data"]
+        raw = user.get("cycle_stats")
+        if raw is not None: return cls(**raw)
+        c_data["dates"] = sorted(set(c_data["dates"]))
+        s = cls.from_dates(c_data["dates"])
+        user["cycle_stats"] = s.to_dict()
+        return s
+
+    @classmethod
+    def edit_dates(cls, user, removed=(), added=()):
+        # 增删经期日期并同步统计值与预测
+        s = cls.for_user(user)
+        dates = user["cycle_data"]["dates"]
+        for d in removed: s.remove_date(dates, d)
+        for d in added: s.add_date(dates, d)
+        user["cycle_stats"] = s.to_dict()
+        user["prediction"] = CyclePredictor.predict(dates)
+        AnalyticsEngine.rebuild_cycle_energy(user)
+
+    def add_date(self, dates, d):
+        i = bisect.bisect_left(dates, d)
+        if i < len(dates) and dates[i] == d: return
+        prev = dates[i-1] if i > 0 else None
+        nxt = dates[i] if i < len(dates) else None
+        self._apply(prev, nxt, -1); self._apply(prev, d, 1); self._apply(d, nxt, 1)
+        dates.insert(i, d)
+        self.n_dates = len(dates); self.last = dates[-1]; self.version += 1
+
+    def remove_date(self, dates, d):
+        i = bisect.bisect_left(dates, d)
+        if i >= len(dates) or dates[i] != d: return
+        prev = dates[i-1] if i > 0 else None
+        nxt = dates[i+1] if i + 1 < len(dates) else None
+        self._apply(prev, d, -1); self._apply(d, nxt, -1); self._apply(prev, nxt, 1)
+        del dates[i]
+        self.n_dates = len(dates); self.last = dates[-1] if dates else None; self.version += 1
+
+    def avg_len(self): return self.total // self.count if self.count else self.DEFAULT_LEN
+    def to_dict(self): return {"count": self.count, "total": self.total, "n_dates": self.n_dates, "last": self.last, "version": self.version}
+
+# ==========================================
+# 🔮 周期预测 (NumPy 批量)
+# ==========================================
+class CyclePredictor:
+    # 用全部有效间隔做近期加权的均值/方差, 预测未来 N 个周期及易孕窗口; 所有用户拼成一个矩阵一次算完
+    HALF_LIFE = 6       # 权重半衰期 (以周期计)
+    MAX_CYCLES = 24     # 只看最近 24 个间隔
+    LUTEAL_LEN = 14     # 黄体期长度, 排卵日 = 下次经期 - 14
+    FERTILE_BEFORE, FERTILE_AFTER = 5, 1
+    Z = 1.28            # 约 80% 预测区间
+    DEFAULT_SD, MIN_SD = 3.0, 1.0
+
+    @classmethod
+    def interval_matrix(cls, dates_lists):
+        # 每个用户一行, 最近的间隔在最后一列, 缺失为 NaN; 同时返回每个用户最后一次经期 (日序数)
+        n = len(dates_lists)
+        lens = np.array([len(d) for d in dates_lists], dtype=np.int64)
+        flat = [d for dates in dates_lists for d in sorted(dates)]
+        ords = np.array(flat, dtype="datetime64[D]").astype(np.int64)
+        uid = np.repeat(np.arange(n), lens)
+        last = np.full(n, np.nan)
+        has = lens > 0
+        last[has] = ords[np.cumsum(lens)[has] - 1]
+        gaps = np.diff(ords)
+        ok = (uid[1:] == uid[:-1]) & (gaps > CycleStats.MIN_GAP) & (gaps < CycleStats.MAX_GAP)
+        g_uid, g_val = uid[1:][ok], gaps[ok]
+        k = np.bincount(g_uid, minlength=n)
+        starts = np.concatenate(([0], np.cumsum(k)[:-1]))
+        col = cls.MAX_CYCLES - k[g_uid] + (np.arange(len(g_val)) - starts[g_uid])
+        keep = col >= 0
+        mat = np.full((n, cls.MAX_CYCLES), np.nan)
+        mat[g_uid[keep], col[keep]] = g_val[keep]
+        return mat, last
+
+    @classmethod
+    def predict_batch(cls, dates_lists, n_cycles=3):
+        mat, last = cls.interval_matrix(dates_lists)
+        age = np.arange(cls.MAX_CYCLES - 1, -1, -1)
+        w = np.where(np.isnan(mat), 0.0, 0.5 ** (age / cls.HALF_LIFE))
+        x = np.nan_to_num(mat)
+        w_sum = w.sum(axis=1)
+        n = (w > 0).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (w * x).sum(axis=1) / w_sum
+            var = (w * (x - mean[:, None]) ** 2).sum(axis=1) / w_sum
+        mean = np.where(n > 0, mean, CycleStats.DEFAULT_LEN)
+        sd = np.where(n > 1, np.maximum(np.sqrt(var), cls.MIN_SD), cls.DEFAULT_SD)
+        k = np.arange(1, n_cycles + 1)
+        start = last[:, None] + mean[:, None] * k
+        half = cls.Z * sd[:, None] * np.sqrt(k)
+        ovulation = start - cls.LUTEAL_LEN
+        return {
+            "mean": mean, "sd": sd, "n": n, "last": last,
+            "start": np.rint(start), "earliest": np.rint(start - half), "latest": np.rint(start + half),
+            "ovulation": np.rint(ovulation),
+            "fertile_start": np.rint(ovulation - cls.FERTILE_BEFORE), "fertile_end": np.rint(ovulation + cls.FERTILE_AFTER),
+        }
+
+    @staticmethod
+    def _iso(ordinal): return date.fromordinal(int(ordinal) + date(1970, 1, 1).toordinal()).isoformat()
+
+    @classmethod
+    def to_record(cls, res, i):
+        # 批量结果第 i 行 -> 可存入用户记录的 JSON 结构; 没有经期记录时返回 None
+        if np.isnan(res["last"][i]): return None
+        cols = ("start", "earliest", "latest", "ovulation", "fertile_start", "fertile_end")
+        cycles = [{c: cls._iso(res[c][i, j]) for c in cols} for j in range(res["start"].shape[1])]
+        return {"based_on": cls._iso(res["last"][i]), "mean": round(float(res["mean"][i]), 1),
+                "sd": round(float(res["sd"][i]), 1), "n": int(res["n"][i]), "cycles": cycles}
+
+    @classmethod
+    def predict(cls, dates, n_cycles=3): return cls.to_record(cls.predict_batch([dates], n_cycles), 0)
+
+    @classmethod
+    def predict_all(cls, n_cycles=3):
+        # 全体用户一次矩阵运算, 供夜间批量预计算
+        names, dates_lists = [], []
+        for u, meta in DataManager.iter_meta():
+            names.append(u); dates_lists.append(meta["cycle_data"].get("dates", []))
+        if not names: return {}
+        res = cls.predict_batch(dates_lists, n_cycles)
+        return {u: cls.to_record(res, i) for i, u in enumerate(names)}
+
+# ==========================================
+# 📈 统计分析 (按月预聚合)
+# ==========================================
+class AnalyticsEngine:
+    # 每月一份汇总 (症状/情绪/习惯计数, 能量均值, 分阶段拆分, 按周期日的能量), 随每次保存增量更新; 查询只遍历月份数
+    VERSION = 2  # 2: 增加 cycle_energy; 版本不符的旧汇总会按日志重建
+    @staticmethod
+    def entry_moods(entry):
+        moods = [entry.get("primary_mood")] + list(entry.get("secondary_moods", []))
+        if not entry.get("primary_mood") and entry.get("moods"): moods = list(entry["moods"])
+        return [m for m in moods if m and m != "无"]
+
+    @staticmethod
+    def _count(counter, keys, sign):
+        for k in keys:
+            if k == "无": continue
+            n = counter.get(k, 0) + sign
+            if n: counter[k] = n
+            else: counter.pop(k, None)
+
+    @staticmethod
+    def cycle_day(dates, day):
+        # day 在其所属周期中的第几天 (从 1 开始); 早于第一次经期或超过最长间隔时为 None
+        i = bisect.bisect_right(dates, day) - 1
+        if i < 0: return None
+        n = (date.fromisoformat(day) - date.fromisoformat(dates[i])).days + 1
+        return n if n < CycleStats.MAX_GAP else None
+
+    @classmethod
+    def apply(cls, rollups, day, entry, sign, dates=()):
+        if not entry: return
+        m = rollups.setdefault(day[:7], {"days": 0, "energy_sum": 0, "energy_n": 0, "symptoms": {}, "moods": {}, "habits": {}, "phases": {}})
+        moods, symptoms = cls.entry_moods(entry), entry.get("symptoms", [])
+        m["days"] += sign
+        if entry.get("energy") is not None:
+            m["energy_sum"] += sign * entry["energy"]; m["energy_n"] += sign
+            cd = cls.cycle_day(dates, day)
+            if cd is not None: cls._add_cycle_energy(m, cd, entry["energy"], sign)
+        cls._count(m["symptoms"], symptoms, sign)
+        cls._count(m["moods"], moods, sign)
+        cls._count(m["habits"], entry.get("meds", []), sign)
+        if entry.get("phase"):
+            p = m["phases"].setdefault(entry["phase"], {"days": 0, "symptoms": {}, "moods": {}})
+            p["days"] += sign
+            cls._count(p["symptoms"], symptoms, sign)
+            cls._count(p["moods"], moods, sign)
+            if not p["days"]: m["phases"].pop(entry["phase"])
+        if not m["days"]: rollups.pop(day[:7])
+
+    @staticmethod
+    def _add_cycle_energy(m, cd, energy, sign):
+        ce = m.setdefault("cycle_energy", {})
+        s, n = ce.get(str(cd), (0, 0))
+        if n + sign: ce[str(cd)] = [s + sign * energy, n + sign]
+        else: ce.pop(str(cd), None)
+        if not ce: m.pop("cycle_energy")
+
+    @classmethod
+    def rebuild(cls, logs, dates=()):
+        rollups = {}
+        for day, entry in logs.items(): cls.apply(rollups, day, entry, 1, dates)
+        return rollups
+
+    @classmethod
+    def rebuild_cycle_energy(cls, user):
+        # 经期日期变动会改变日志所属的周期日: 只重算 cycle_energy 部分 (编辑经期日期很少发生)
+        rollups, dates = cls.for_user(user), user["cycle_data"]["dates"]
+        for m in rollups.values(): m.pop("cycle_energy", None)
+        for day, entry in user["cycle_data"]["logs"].items():
+            cd = cls.cycle_day(dates, day) if entry and entry.get("energy") is not None else None
+            if cd is not None: cls._add_cycle_energy(rollups[day[:7]], cd, entry["energy"], 1)
+
+    @classmethod
+    def needs_rebuild(cls, user): return "rollups" not in user or user.get("rollups_ver") != cls.VERSION
+
+    @classmethod
+    def for_user(cls, user):
+        # 旧数据没有汇总 (或汇总版本过旧): 全量重建一次, 之后随记录一起保存
+        if cls.needs_rebuild(user):
+            user["rollups"] = cls.rebuild(user["cycle_data"]["logs"], user["cycle_data"]["dates"])
+            user["rollups_ver"] = cls.VERSION
+        return user["rollups"]
+
+    @classmethod
+    def update(cls, user, day, old, new):
+        rollups = cls.for_user(user)
+        cls.apply(rollups, day, old, -1, user["cycle_data"]["dates"])
+        cls.apply(rollups, day, new, 1, user["cycle_data"]["dates"])
+
+    @staticmethod
+    def month_key(d, months_back=0):
+        m = d.year * 12 + (d.month - 1) - months_back
+        return f"{m // 12}-{m % 12 + 1:02d}"
+
+    @classmethod
+    def window(cls, rollups, start=None, end=None):
+        # 合并 [start, end] 月份 ("YYYY-MM") 的汇总
+        out = {"months": 0, "days": 0, "energy_sum": 0, "energy_n": 0, "symptoms": {}, "moods": {}, "habits": {}, "phases": {}}
+        for key in sorted(rollups):
+            if (start and key < start) or (end and key > end): continue
+            m = rollups[key]
+            out["months"] += 1
+            for f in ("days", "energy_sum", "energy_n"): out[f] += m[f]
+            for f in ("symptoms", "moods", "habits"): cls._merge(out[f], m[f])
+            for ph, p in m["phases"].items():
+                q = out["phases"].setdefault(ph, {"days": 0, "symptoms": {}, "moods": {}})
+                q["days"] += p["days"]; cls._merge(q["symptoms"], p["symptoms"]); cls._merge(q["moods"], p["moods"])
+        out["energy_mean"] = round(out["energy_sum"] / out["energy_n"], 1) if out["energy_n"] else None
+        return out
+
+    @classmethod
+    def last_months(cls, rollups, n, today=None):
+        today = today or date.today()
+        return cls.window(rollups, cls.month_key(today, n - 1), cls.month_key(today))
+
+    @staticmethod
+    def _merge(dst, src):
+        for k, v in src.items(): dst[k] = dst.get(k, 0) + v
+
+    @staticmethod
+    def top(counter, n=3): return sorted(counter.items(), key=lambda x: x[1], reverse=True)[:n]
+
+# ==========================================
+# 📉 趋势序列 (由月度汇总降采样)
+# ==========================================
+class TrendSeries:
+    # 图表数据只来自月度汇总: 多年历史也只合并几十个月份桶, 月份过多时再合并成最多 MAX_POINTS 个时间桶
+    MAX_POINTS = 24
+
+    @classmethod
+    def buckets(cls, keys, max_points=None):
+        # 连续月份等分成不超过 max_points 个桶, 返回 [(标签, 起始月, 结束月)]
+        keys, max_points = sorted(keys), max_points or cls.MAX_POINTS
+        if not keys: return []
+        first, last = (int(k[:4]) * 12 + int(k[5:7]) - 1 for k in (keys[0], keys[-1]))
+        step = -(-(last - first + 1) // max_points)
+        key = lambda m: f"{m // 12}-{m % 12 + 1:02d}"
+        out = []
+        for m in range(first, last + 1, step):
+            e = min(m + step, last + 1) - 1
+            out.append((key(m) if e == m else f"{key(m)}~{key(e)[2:]}", key(m), key(e)))
+        return out
+
+    @staticmethod
+    def energy_by_cycle_day(rollups):
+        # [(周期日, 平均能量)], 跨所有周期平均
+        acc = {}
+        for m in rollups.values():
+            for cd, (s, n) in m.get("cycle_energy", {}).items():
+                a = acc.setdefault(int(cd), [0, 0]); a[0] += s; a[1] += n
+        return [(cd, round(s / n, 1)) for cd, (s, n) in sorted(acc.items()) if n]
+
+    @staticmethod
+    def symptom_by_phase(rollups, top=8):
+        # [(阶段, 症状, 每 100 天出现次数)], 只取总体最常见的 top 个症状
+        w = AnalyticsEngine.window(rollups)
+        keep = [k for k, _ in AnalyticsEngine.top(w["symptoms"], top)]
+        return [(MedicalEngine.PHASE_NAMES.get(ph, ph), s, round(100 * p["symptoms"].get(s, 0) / p["days"], 1))
+                for ph in MedicalEngine.PHASE_KEYS if (p := w["phases"].get(ph)) and p["days"] for s in keep]
+
+    @classmethod
+    def mood_by_month(cls, rollups, top=5, max_points=None):
+        # [(时间桶, {情绪: 次数})], 只取总体最常见的 top 个情绪
+        keys = sorted(rollups)
+        keep = [k for k, _ in AnalyticsEngine.top(AnalyticsEngine.window(rollups)["moods"], top)]
+        rows = []
+        for label, start, end in cls.buckets(keys, max_points):
+            counts = dict.fromkeys(keep, 0)
+            for key in keys[bisect.bisect_left(keys, start):bisect.bisect_right(keys, end)]:
+                moods = rollups[key]["moods"]
+                for k in keep: counts[k] += moods.get(k, 0)
+            rows.append((label, counts))
+        return rows
+
+    @staticmethod
+    @st.cache_data(max_entries=64, show_spinner=False)
+    def cached(username, rev, _rollups):
+        # 按 (用户, 数据版本) 缓存; _rollups 不参与哈希
+        return {"energy": TrendSeries.energy_by_cycle_day(_rollups), "symptoms": TrendSeries.symptom_by_phase(_rollups),
+                "moods": TrendSeries.mood_by_month(_rollups)}
+
+# ==========================================
+# 🌙 每日预计算快照
+# ==========================================
+class DailySnapshot:
+    # 当天的阶段/下次经期/近 6 个月报告摘要: 每次写入时随记录一起刷新, 跨天由 worker.py 批量重算; 界面渲染时直接读取
+    @staticmethod
+    def build(user, today=None):
+        today = today or date.today()
+        stats = CycleStats.for_user(user)
+        snap = {"date": today.isoformat(), "rev": user.get("rev", 0), "day": 1, "avg": CycleStats.DEFAULT_LEN,
+                "phase_name": "等待记录", "phase_key": "menstrual", "next_p": "--", "next_range": ""}
+        if stats.n_dates:
+            last = date.fromisoformat(stats.last)
+            snap["avg"] = avg = stats.avg_len()
+            snap["day"] = (today - last).days + 1
+            snap["phase_name"], snap["phase_key"] = MedicalEngine(25).determine_phase(snap["day"], avg)
+            pred = user.get("prediction")
+            if pred and pred["based_on"] == stats.last:
+                nxt = pred["cycles"][0]
+                snap["next_p"] = date.fromisoformat(nxt["start"]).strftime('%m月%d日')
+                snap["next_range"] = f"{date.fromisoformat(nxt['earliest']).strftime('%m.%d')} - {date.fromisoformat(nxt['latest']).strftime('%m.%d')}"
+            else: snap["next_p"] = (last + timedelta(days=avg)).strftime('%m月%d日')
+        snap["summary"] = DailySnapshot.summary(AnalyticsEngine.last_months(AnalyticsEngine.for_user(user), 6, today))
+        return snap
+
+    @staticmethod
+    def summary(recent):
+        fmt = lambda counter: ", ".join(k.split(" (")[0] for k, _ in AnalyticsEngine.top(counter))
+        return {"days": recent["days"], "symptoms": fmt(recent["symptoms"]), "moods": fmt(recent["moods"]), "energy": recent["energy_mean"]}
+
+    @staticmethod
+    def refresh(user, today=None):
+        user["daily"] = DailySnapshot.build(user, today)
+        return user["daily"]
+
+    @staticmethod
+    def is_fresh(user, today=None):
+        snap = user.get("daily")
+        return bool(snap) and snap["date"] == (today or date.today()).isoformat() and snap["rev"] == user.get("rev", 0)
+
+    @staticmethod
+    def get(user, today=None):
+        # 快照是当天且对应当前 rev 时 O(1) 读取; 否则 (worker 未运行/刚跨天) 现算一份但不写回
+        return user["daily"] if DailySnapshot.is_fresh(user, today) else DailySnapshot.build(user, today)
 
 # ==========================================
 # 📄 报告生成器
 # ==========================================
 class ReportGenerator:
     @staticmethod
+    @Profiler.timed("report.generate_html")
     def generate_html_report(username, user_data, avg_len):
         today = date.today().strftime("%Y-%m-%d")
-        logs = user_data["cycle_data"]["logs"]
         dates = user_data["cycle_data"]["dates"]
-        total_logs = len(logs)
-        symptoms_count = {}
-        for k, v in logs.items():
-            for s in v.get("symptoms", []): 
-                if s != "无": symptoms_count[s] = symptoms_count.get(s, 0) + 1
-        top_symptoms = sorted(symptoms_count.items(), key=lambda x: x[1], reverse=True)[:3]
-        symptom_str = ", ".join([f"{k}({v}次)" for k,v in top_symptoms]) if top_symptoms else "无明显高频症状"
+        total_logs = len(user_data["cycle_data"]["logs"])
+        recent = AnalyticsEngine.last_months(AnalyticsEngine.for_user(user_data), 6)
+        fmt = lambda counter: ", ".join([f"{k}({v}次)" for k,v in AnalyticsEngine.top(counter)])
+        symptom_str = fmt(recent["symptoms"]) or "无明显高频症状"
+        mood_str = fmt(recent["moods"]) or "无"
+        habit_str = fmt(recent["habits"]) or "无"
+        energy_str = f"{recent['energy_mean']} / 100" if recent["energy_mean"] is not None else "无数据"
+        phase_rows = "".join(f"<tr><td>{MedicalEngine.PHASE_NAMES.get(ph, ph)}</td><td>{p['days']}</td><td>{fmt(p['symptoms']) or '-'}</td><td>{fmt(p['moods']) or '-'}</td></tr>"
+                             for ph, p in recent["phases"].items())
+        cycle_rows = ReportGenerator.cycle_rows(dates)
+        months = [AnalyticsEngine.month_key(date.today(), i) for i in range(11, -1, -1)]
+        rollups = user_data["rollups"]
+        energy = [round(rollups[m]["energy_sum"] / rollups[m]["energy_n"]) if m in rollups and rollups[m]["energy_n"] else 0 for m in months]
+        energy_chart = ReportGenerator.svg_bars([m[2:] for m in months], energy, 100)
+        rule_rows = ReportGenerator.rule_rows(RuleEngine.batch(user_data["cycle_data"]["logs"]), total_logs)
 
         html = f"""
         <html>
@@ -330,6 +1818,8 @@ class ReportGenerator:
                 h2 {{ color: #555; margin-top: 30px; }}
                 .stat-box {{ background: #f9f9f9; padding: 15px; border-radius: 8px; margin: 10px 0; }}
                 .footer {{ margin-top: 50px; font-size: 0.8em; color: #999; text-align: center; }}
+                table {{ border-collapse: collapse; width: 100%; }}
+                td, th {{ border-bottom: 1px solid #eee; padding: 6px; text-align: left; }}
             </style>
         </head>
         <body>
@@ -344,8 +1834,19 @@ class ReportGenerator:
             <h2>2. 症状统计 (近6个月)</h2>
             <div class="stat-box">
                 <p><b>高频症状:</b> {symptom_str}</p>
-                <p><b>总记录天数:</b> {total_logs} 天</p>
+                <p><b>常见情绪:</b> {mood_str}</p>
+                <p><b>平均能量值:</b> {energy_str}</p>
+                <p><b>常见习惯/用药:</b> {habit_str}</p>
+                <p><b>近6个月记录:</b> {recent['days']} 天 &nbsp;&nbsp; <b>总记录天数:</b> {total_logs} 天</p>
             </div>
+            <h2>3. 分阶段统计 (近6个月)</h2>
+            <table><tr><th>阶段</th><th>天数</th><th>高频症状</th><th>常见情绪</th></tr>{phase_rows}</table>
+            <h2>4. 每月平均能量 (近12个月)</h2>
+            {energy_chart}
+            <h2>5. 周期明细</h2>
+            <table><tr><th>开始日期</th><th>周期长度</th><th>备注</th></tr>{cycle_rows}</table>
+            <h2>6. 健康提示统计 (全部记录)</h2>
+            <table><tr><th>提示</th><th>触发天数</th><th>占比</th><th>参考</th></tr>{rule_rows}</table>
             <p style="font-size: 0.9em; color: #666;">本报告不构成医疗诊断。参考: ACOG, WHO Guidelines.</p>
         </body>
         </html>
@@ -353,18 +1854,54 @@ class ReportGenerator:
         return html
 
     @staticmethod
-    def get_download_link(html_string, filename="medical_report.html"):
-        b64 = base64.b64encode(html_string.encode()).decode()
-        return f'<a href="data:text/html;base64,{b64}" download="{filename}" style="text-decoration:none; background:#e91e63; color:white; padding:8px 15px; border-radius:20px; font-weight:bold;">📄 下载医疗报告</a>'
+    def cycle_rows(dates):
+        rows = []
+        for i, d in enumerate(dates):
+            if i + 1 < len(dates):
+                gap = (date.fromisoformat(dates[i+1]) - date.fromisoformat(d)).days
+                note = "" if CycleStats.MIN_GAP < gap < CycleStats.MAX_GAP else "异常间隔, 未计入平均"
+                rows.append(f"<tr><td>{d}</td><td>{gap} 天</td><td>{note}</td></tr>")
+            else: rows.append(f"<tr><td>{d}</td><td>进行中</td><td></td></tr>")
+        return "".join(reversed(rows))
+
+    @staticmethod
+    def rule_rows(counts, total):
+        rules = {r["id"]: r for r in MedicalEngine.RULES}
+        rows = [f"<tr><td>{rules[rid].get('title') or rules[rid]['text']}</td><td>{n} 天</td>"
+                f"<td>{n / total:.0%}</td><td>{MedicalEngine.MEDICAL_DB.get(rules[rid].get('citation'), '')}</td></tr>"
+                for rid, n in sorted(counts.items(), key=lambda x: -x[1])]
+        return "".join(rows) or "<tr><td colspan='4'>暂无</td></tr>"
+
+    @staticmethod
+    def svg_bars(labels, values, max_value, width=600, height=160):
+        # 内嵌 SVG 柱状图, 报告是单个离线 HTML 文件
+        bw = width / max(len(values), 1)
+        bars = []
+        for i, (label, v) in enumerate(zip(labels, values)):
+            h = (height - 30) * v / max_value if max_value else 0
+            x = i * bw
+            bars.append(f'<rect x="{x + 4:.0f}" y="{height - 20 - h:.0f}" width="{bw - 8:.0f}" height="{h:.0f}" fill="#f48fb1"/>'
+                        f'<text x="{x + bw / 2:.0f}" y="{height - 5}" font-size="10" text-anchor="middle">{label}</text>'
+                        f'<text x="{x + bw / 2:.0f}" y="{height - 24 - h:.0f}" font-size="10" text-anchor="middle">{v or ""}</text>')
+        return f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg">{"".join(bars)}</svg>'
+
+    @staticmethod
+    @st.cache_data(max_entries=64, show_spinner=False)
+    def cached_report(username, rev, today, avg_len, _user_data):
+        # 按 (用户, 数据版本, 日期) 缓存; _user_data 不参与哈希
+        return ReportGenerator.generate_html_report(username, _user_data, avg_len)
 
 # ==========================================
 # 🗓️ 日历生成器
 # ==========================================
 class CalendarGenerator:
     @staticmethod
-    def generate_compact_html(year, month, logs):
+    @Profiler.timed("calendar.generate_html")
+    def generate_compact_html(year, month, logs, period_dates=(), cycle_len=28):
         cal = calendar.monthcalendar(year, month)
         today = date.today()
+        n_days = calendar.monthrange(year, month)[1]
+        _, phases = MedicalEngine.phases_for_range(date(year, month, 1), date(year, month, n_days), period_dates, cycle_len, today)
         parts = ['<div class="calendar-container">']
         for w in ['一','二','三','四','五','六','日']: parts.append(f'<div class="calendar-header">{w}</div>')
         for week in cal:
@@ -374,6 +1911,7 @@ class CalendarGenerator:
                     d_str = f"{year}-{month:02d}-{day:02d}"
                     is_today = (today.year==year and today.month==month and today.day==day)
                     cls = "day-today" if is_today else ""
+                    if phases[day-1]: cls += f" phase-{phases[day-1]}"
                     entry = logs.get(d_str, {})
                     p_mood = entry.get("primary_mood")
                     if not p_mood and entry.get("moods"): p_mood = entry["moods"][0]
@@ -385,33 +1923,246 @@ class CalendarGenerator:
         parts.append('</div>')
         return "".join(parts)
 
+class CalendarCache:
+    # 进程级 LRU: 按 (用户, 年, 月, 当月内容摘要, 周期长度, 今天) 缓存整月 HTML; 只有改动的月份会重新渲染
+    CAPACITY = 256
+
+    @staticmethod
+    @st.cache_resource(show_spinner=False)
+    def _state(): return {"lru": OrderedDict(), "lock": threading.Lock(), "hits": 0, "misses": 0}
+
+    @staticmethod
+    def shift(year, month, delta):
+        m = year * 12 + (month - 1) + delta
+        return m // 12, m % 12 + 1
+
+    @staticmethod
+    def digest(year, month, c_data):
+        # 当月日志 + 经期日期的摘要: 内容变了键就变, 不依赖版本号单调递增 (导入/恢复会重建记录)
+        logs, prefix = c_data["logs"], f"{year}-{month:02d}-"
+        days = [(d, logs[d]) for d in (f"{prefix}{i:02d}" for i in range(1, calendar.monthrange(year, month)[1] + 1)) if d in logs]
+        return hashlib.blake2b(json.dumps([days, c_data["dates"]], ensure_ascii=False, sort_keys=True).encode(), digest_size=16).digest()
+
+    @classmethod
+    def render(cls, username, year, month, c_data, cycle_len):
+        key = (username, year, month, cls.digest(year, month, c_data), cycle_len, date.today())
+        s = cls._state()
+        with s["lock"]:
+            html = s["lru"].get(key)
+            if html is not None:
+                s["lru"].move_to_end(key); s["hits"] += 1
+                return html
+            s["misses"] += 1
+        html = CalendarGenerator.generate_compact_html(year, month, c_data["logs"], c_data["dates"], cycle_len)
+        with s["lock"]:
+            s["lru"][key] = html
+            while len(s["lru"]) > cls.CAPACITY: s["lru"].popitem(last=False)
+        return html
+
+    @classmethod
+    def prefetch(cls, username, year, month, c_data, cycle_len):
+        # 预渲染前后两个月, ◀/▶ 时直接命中
+        for delta in (-1, 1): cls.render(username, *cls.shift(year, month, delta), c_data, cycle_len)
+
+    @classmethod
+    def stats(cls):
+        s = cls._state()
+        return {"hits": s["hits"], "misses": s["misses"], "size": len(s["lru"])}
+
+# ==========================================
+# 📔 日记时间线
+# ==========================================
+class LogIndex:
+    # 日志日期的有序索引 (ISO 日期字符串天然按时间排序): 区间查询 O(log n), 倒序游标分页
+    def __init__(self, days): self.days = sorted(days)
+
+    def update(self, day, old, new):
+        if old is None: bisect.insort(self.days, day)
+
+    def range(self, start=None, end=None):
+        lo = bisect.bisect_left(self.days, start) if start else 0
+        hi = bisect.bisect_right(self.days, end) if end else len(self.days)
+        return self.days[lo:hi]
+
+    def page(self, before=None, limit=10):
+        # 返回 before (不含) 之前最近的 limit 天 (新 -> 旧) 和下一页游标, 没有更多时游标为 None
+        hi = bisect.bisect_left(self.days, before) if before else len(self.days)
+        lo = max(0, hi - limit)
+        keys = self.days[lo:hi][::-1]
+        return keys, (keys[-1] if lo > 0 else None)
+
+class SearchIndex:
+    # 日记倒排索引: 每个词/选项一个位图 (Python 大整数, 第 i 位 = base 之后第 i 天); 布尔查询是整数的 与/或/非, 日期区间是一个掩码
+    # 备注按 CJK 单字 + 相邻双字、英文/数字按整词切分; 情绪/症状/习惯/阶段各自是一个词项; 随 UserCache 写入增量维护
+    WORD = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+    DATE_ARG = re.compile(r"(from|to):(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?$")
+    FIELDS = (("m:", LogCodec.MOODS), ("s:", LogCodec.SYMPTOMS), ("h:", LogCodec.HABITS))
+
+    def __init__(self, logs):
+        self.logs, self.base, self.all, self.postings = logs, None, 0, {}
+        for day, entry in logs.items(): self._add(day, entry)
+
+    @classmethod
+    def tokens(cls, text):
+        out = set()
+        for run in cls.WORD.findall(text.lower()):
+            if run[0] >= "\u3400":
+                out.update(run)
+                out.update(run[i:i + 2] for i in range(len(run) - 1))
+            else: out.add(run)
+        return out
+
+    @classmethod
+    def terms(cls, entry):
+        t = {"w:" + tok for tok in cls.tokens(entry.get("note") or "")}
+        t.update("m:" + m for m in AnalyticsEngine.entry_moods(entry))
+        t.update("s:" + s for s in entry.get("symptoms", []) if s != "无")
+        t.update("h:" + h for h in entry.get("meds", []) if h != "无")
+        if entry.get("phase"): t.add("p:" + entry["phase"])
+        return t
+
+    def _offset(self, day):
+        o = date.fromisoformat(day).toordinal()
+        if self.base is None: self.base = o
+        if o < self.base:
+            # 比已有记录更早的一天: 所有位图整体左移, 重新定基
+            shift = self.base - o
+            self.postings = {k: v << shift for k, v in self.postings.items()}
+            self.all <<= shift; self.base = o
+        return o - self.base
+
+    def _add(self, day, entry):
+        if not entry: return
+        bit = 1 << self._offset(day)
+        self.all |= bit
+        for t in self.terms(entry): self.postings[t] = self.postings.get(t, 0) | bit
+
+    def _remove(self, day, entry):
+        if not entry: return
+        mask = ~(1 << self._offset(day))
+        self.all &= mask
+        for t in self.terms(entry):
+            v = self.postings.get(t, 0) & mask
+            if v: self.postings[t] = v
+            else: self.postings.pop(t, None)
+
+    def update(self, day, old, new): self._remove(day, old); self._add(day, new)
+
+    def days(self, bits, limit=None):
+        # 位图 -> 日期列表 (新 -> 旧); 转成二进制字符串后用 find 找置位, 比逐位移位快得多
+        s, out, j = bin(bits)[2:], [], -1
+        top = self.base + len(s) - 1 if bits else 0
+        while limit is None or len(out) < limit:
+            j = s.find("1", j + 1)
+            if j < 0: break
+            out.append(date.fromordinal(top - j).isoformat())
+        return out
+
+    def term_bits(self, term):
+        # 一个查询词 = 包含它的选项 (如 "饮酒" -> "🍺 饮酒") ∪ 备注里出现它的日子; 超过两个字时用原文核对, 排除双字拼凑的误命中
+        term = term.lower()
+        bits = 0
+        for prefix, vocab in self.FIELDS:
+            for v in vocab:
+                if term in v.lower(): bits |= self.postings.get(prefix + v, 0)
+        for key, name in MedicalEngine.PHASE_NAMES.items():
+            if term == key or term in name: bits |= self.postings.get("p:" + key, 0)
+        toks = self.tokens(term)
+        if toks:
+            text = self.all
+            for t in toks: text &= self.postings.get("w:" + t, 0)
+            if text and len(term) > 2:
+                for day in self.days(text):
+                    if term not in (self.logs.get(day) or {}).get("note", "").lower(): text &= ~(1 << self._offset(day))
+            bits |= text
+        return bits
+
+    def range_mask(self, start=None, end=None):
+        lo = max(0, date.fromisoformat(start).toordinal() - self.base) if start else 0
+        hi = date.fromisoformat(end).toordinal() - self.base if end else self.all.bit_length()
+        return ((1 << (hi + 1)) - 1) & ~((1 << lo) - 1) if hi >= 0 else 0
+
+    @classmethod
+    def _date_arg(cls, kind, y, m, d):
+        # 月/日超出范围 (如 2025-13, 2025-02-30) 返回 None, 调用方把它当普通词处理
+        y, m = int(y), int(m or (1 if kind == "from" else 12))
+        try:
+            if d: return date(y, m, int(d)).isoformat()
+            return date(y, m, 1 if kind == "from" else calendar.monthrange(y, m)[1]).isoformat()
+        except (ValueError, calendar.IllegalMonthError): return None
+
+    def search(self, query, start=None, end=None, limit=None): return self.days(self.query(query, start, end), limit)
+
+    def query(self, query, start=None, end=None):
+        # 空格 = 与, OR = 或, -词 = 非, from:/to: 限定日期 (可写到年或月); 返回命中日期的位图
+        if self.base is None: return 0
+        groups = [[]]
+        for tok in query.split():
+            m = self.DATE_ARG.match(tok)
+            arg = self._date_arg(*m.groups()) if m else None
+            if arg and m.group(1) == "from": start = arg
+            elif arg: end = arg
+            elif tok.upper() in ("OR", "|"): groups.append([])
+            else: groups[-1].append(tok)
+        if not any(groups) and not (start or end): return 0
+        result = 0
+        for group in groups:
+            bits = self.all
+            for t in group:
+                if t.startswith("-") and len(t) > 1: bits &= ~self.term_bits(t[1:])
+                else: bits &= self.term_bits(t)
+            result |= bits
+        return result & self.range_mask(start, end)
+
+class DiaryTimeline:
+    PAGE_SIZE = 10
+    SEARCH_LIMIT = 30
+    MED_TAG = "<span style='font-size:0.8em; background:#eee; padding:2px 5px; border-radius:4px;'>{}</span>"
+
+    @staticmethod
+    def render(logs, keys):
+        # 一页日记拼成一个 HTML 块, 只调用一次 st.markdown
+        parts = []
+        for d_str in keys:
+            entry = logs[d_str]
+            p_mood = entry.get("primary_mood")
+            if not p_mood and entry.get("moods"): p_mood = entry["moods"][0]
+            s_moods = entry.get("secondary_moods", [])
+            if not s_moods and entry.get("moods"): s_moods = entry["moods"][1:]
+            note = entry.get("note", "")
+            p_emo = MedicalEngine.EMOJI_MAP.get(p_mood, "😶") if p_mood and p_mood!="无" else "😶"
+            s_emo_str = "".join([MedicalEngine.EMOJI_MAP.get(m, "") for m in s_moods])
+            meds_str = " ".join([DiaryTimeline.MED_TAG.format(m) for m in entry.get("meds", [])])
+            parts.append(
+                f'<div class="timeline-entry"><div class="timeline-date">{d_str[5:7]}.{d_str[8:10]}</div>'
+                f'<div class="timeline-mood-big">{p_emo}</div><div class="timeline-details">'
+                f'<div class="timeline-sub-moods">{s_emo_str} {meds_str}</div>'
+                f'<div class="timeline-note">{escape(note) if note else "无备注"}</div></div></div>')
+        return "".join(parts)
+
 # ==========================================
 # 🖥️ 主界面 (V10.6)
 # ==========================================
 def main_app_ui(username):
     inject_custom_css()
-    all_data = DataManager.load_all_data()
-    user = all_data["users"][username]
+    Profiler.lap("ui.css")
+    cache = UserCache.session()
+    user = cache.get(username)
     c_data = user["cycle_data"]
+    Profiler.lap("ui.load_user")
     
     if "cal_year" not in st.session_state:
         st.session_state.cal_year = date.today().year
         st.session_state.cal_month = date.today().month
 
     today = date.today()
-    if not c_data["dates"]:
-        phase_name="等待记录"; phase_key="menstrual"; day=1; avg=28; next_p="--"
-    else:
-        dates = sorted([datetime.strptime(d,"%Y-%m-%d").date() for d in c_data["dates"]])
-        last = dates[-1]
-        diffs = [(dates[i+1]-dates[i]).days for i in range(len(dates)-1)]
-        valid = [d for d in diffs if 15 < d < 60]
-        avg = int(np.mean(valid)) if valid else 28
-        day = (today - last).days + 1
-        phase_name, phase_key = MedicalEngine(25).determine_phase(day, avg)
-        next_p = (last + timedelta(days=avg)).strftime('%m月%d日')
+    stats = CycleStats.for_user(user)
+    snap = DailySnapshot.get(user, today)
+    phase_name, phase_key, day, avg = snap["phase_name"], snap["phase_key"], snap["day"], snap["avg"]
+    next_p, next_range = snap["next_p"], snap["next_range"]
 
     med_engine = MedicalEngine(25)
+    Profiler.lap("ui.stats")
     
     # Sidebar
     with st.sidebar:
@@ -425,22 +2176,28 @@ def main_app_ui(username):
         st.header(f"👋 {username}")
         if st.button("🚪 登出"): st.session_state.logged_in = False; st.rerun()
         st.divider()
-        report_html = ReportGenerator.generate_html_report(username, user, avg)
-        st.markdown(ReportGenerator.get_download_link(report_html), unsafe_allow_html=True)
+        # 只在点击下载时生成报告 (callable), 不再每次 rerun 生成并 base64 嵌入页面
+        st.download_button("📄 下载医疗报告", data=lambda: ReportGenerator.cached_report(username, user.get("rev", 0), today, avg, user),
+                           file_name="medical_report.html", mime="text/html", on_click="ignore", type="primary")
+        s = snap["summary"]
+        if s["days"]: st.caption(f"近6个月记录 {s['days']} 天 · 高频症状: {s['symptoms'] or '无'} · 常见情绪: {s['moods'] or '无'}"
+                                 + (f" · 平均能量 {s['energy']}" if s["energy"] is not None else ""))
         st.divider()
         st.subheader("📅 最近经期")
         if c_data["dates"]:
-            df = pd.DataFrame({"日期": c_data["dates"]})
-            df["日期"] = pd.to_datetime(df["日期"]).dt.date
-            edited = st.data_editor(df.sort_values("日期", ascending=False).head(3), key="sb_editor", use_container_width=True, hide_index=True)
+            shown = c_data["dates"][-3:][::-1]
+            df = pd.DataFrame({"日期": [date.fromisoformat(d) for d in shown]})
+            edited = st.data_editor(df, key="sb_editor", use_container_width=True, hide_index=True)
             if st.button("更新"):
-                dates = edited["日期"].astype(str).tolist()
-                c_data["dates"] = sorted(list(set(dates)))
-                DataManager.save_all_data(all_data); st.rerun()
+                # 只对改动的几行做增量更新, 更早的经期记录保持不动
+                new = set(d for d in edited["日期"].astype(str).tolist() if re.fullmatch(r"\d{4}-\d{2}-\d{2}", d))
+                removed, added = set(shown) - new, new - set(shown)
+                cache.save_meta(username, user, lambda u: CycleStats.edit_dates(u, removed, added)); st.rerun()
         else:
             if st.button("记录今天"): 
-                c_data["dates"].append(date.today().strftime("%Y-%m-%d"))
-                DataManager.save_all_data(all_data); st.rerun()
+                cache.save_meta(username, user, lambda u: CycleStats.edit_dates(u, added=[date.today().strftime("%Y-%m-%d")])); st.rerun()
+
+    Profiler.lap("ui.sidebar")
 
     # Main
     col_left, col_right = st.columns([1.6, 1]) 
@@ -453,7 +2210,7 @@ def main_app_ui(username):
             <h1 style="font-size: 3.5em; margin: 10px 0;">{phase_name}</h1>
             <div style="display:flex; justify-content:space-between; align-items:end;">
                 <div><span style="font-size:1.2em; font-weight:bold;">Day {day}</span> <span style="opacity:0.7;"> / {avg} 天周期</span></div>
-                <div style="text-align:right;"><div style="font-size:0.8em;">预计下次</div><div style="font-size:1.5em; font-weight:bold;">{next_p}</div></div>
+                <div style="text-align:right;"><div style="font-size:0.8em;">预计下次</div><div style="font-size:1.5em; font-weight:bold;">{next_p}</div><div style="font-size:0.7em; opacity:0.7;">{next_range}</div></div>
             </div>
             <div class="warm-message">{warm_msg}</div>
         </div>
@@ -486,8 +2243,7 @@ def main_app_ui(username):
                     safe_sm = [s for s in sm if s != "无"]
                     safe_sym = [s for s in sym if s != "无"]
                     safe_meds = [m for m in meds if m != "无"]
-                    c_data["logs"][k] = {"primary_mood": pm, "secondary_moods": safe_sm, "energy": energy, "symptoms": safe_sym, "meds": safe_meds, "note": note}
-                    DataManager.save_all_data(all_data)
+                    cache.save_log(username, user, k, {"primary_mood": pm, "secondary_moods": safe_sm, "energy": energy, "symptoms": safe_sym, "meds": safe_meds, "note": note, "phase": phase_key})
                     st.session_state.show_analysis = True
                     st.session_state.last_inp = {"pm": pm, "sm": safe_sm, "sym": safe_sym, "meds": safe_meds}
                     st.rerun()
@@ -500,6 +2256,24 @@ def main_app_ui(username):
                 st.success(f"🥗 {rep['diet']} | 🧘‍♀️ {rep['lifestyle']}")
                 if st.button("收起"): st.session_state.show_analysis=False; st.rerun()
             st.markdown('</div>', unsafe_allow_html=True)
+    Profiler.lap("ui.main_card")
+
+    with col_left, st.expander("📈 趋势图"):
+        trends = TrendSeries.cached(username, user.get("rev", 0), AnalyticsEngine.for_user(user))
+        if not trends["energy"] and not trends["moods"]: st.caption("记录几天之后这里会出现趋势图~")
+        if trends["energy"]:
+            st.markdown("**🔋 周期内能量变化** (各周期平均)")
+            st.line_chart(pd.DataFrame(trends["energy"], columns=["周期第几天", "平均能量"]).set_index("周期第几天"), height=220)
+        if trends["symptoms"]:
+            st.markdown("**🩺 各阶段症状频率** (每 100 天)")
+            st.vega_lite_chart(pd.DataFrame(trends["symptoms"], columns=["阶段", "症状", "频率"]), {
+                "mark": "rect", "height": 220,
+                "encoding": {"x": {"field": "阶段", "type": "nominal", "sort": None}, "y": {"field": "症状", "type": "nominal", "sort": None},
+                             "color": {"field": "频率", "type": "quantitative", "scale": {"scheme": "reds"}}, "tooltip": [{"field": "频率"}]}}, use_container_width=True)
+        if trends["moods"]:
+            st.markdown("**🌈 情绪频率** (按月)")
+            st.bar_chart(pd.DataFrame([c for _, c in trends["moods"]], index=[l for l, _ in trends["moods"]]), height=220)
+    Profiler.lap("ui.trends")
 
     with col_right:
         st.markdown('<div class="soft-card" style="padding: 10px 15px;">', unsafe_allow_html=True)
@@ -513,43 +2287,45 @@ def main_app_ui(username):
             st.session_state.cal_month += 1
             if st.session_state.cal_month == 13: st.session_state.cal_month=1; st.session_state.cal_year+=1
             st.rerun()
-        cal_html = CalendarGenerator.generate_compact_html(st.session_state.cal_year, st.session_state.cal_month, c_data["logs"])
-        st.markdown(cal_html, unsafe_allow_html=True)
+        cal_args = (username, st.session_state.cal_year, st.session_state.cal_month, c_data, avg)
+        st.markdown(CalendarCache.render(*cal_args), unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
+        Profiler.lap("ui.calendar")
+        CalendarCache.prefetch(*cal_args)
+        Profiler.lap("ui.calendar_prefetch")
         
         st.markdown("#### 📔 心情日记")
+        q = st.text_input("搜索日记", key="diary_q", label_visibility="collapsed", placeholder="🔍 头痛 饮酒 · 开心 OR 平静 · -熬夜 · from:2025-01 to:2025-06")
         st.markdown('<div class="soft-card" style="padding: 0 20px;">', unsafe_allow_html=True)
-        logs = c_data["logs"]
-        sorted_keys = sorted(logs.keys(), reverse=True)[:10]
-        if not sorted_keys:
-            st.caption("暂无日记，快去记录今天吧~")
+        index = cache.derived(username, "log_index", lambda u: LogIndex(u["cycle_data"]["logs"]))
+        if st.session_state.get("diary_user") != username: st.session_state.diary_user = username; st.session_state.diary_until = None
+        until = st.session_state.diary_until
+        if q.strip():
+            # 搜索模式: 倒排索引首次搜索时构建, 之后随保存增量更新
+            search = cache.derived(username, "search", lambda u: SearchIndex(u["cycle_data"]["logs"]))
+            bits = search.query(q)
+            keys = search.days(bits, DiaryTimeline.SEARCH_LIMIT)
+            st.caption(f"找到 {bits.bit_count()} 天" + (f"，显示最近 {len(keys)} 天" if bits.bit_count() > len(keys) else ""))
+        else: keys = index.range(until)[::-1] if until else index.page(limit=DiaryTimeline.PAGE_SIZE)[0]
+        if not keys:
+            st.caption("没有匹配的日记" if q.strip() else "暂无日记，快去记录今天吧~")
         else:
-            for d_str in sorted_keys:
-                entry = logs[d_str]
-                p_mood = entry.get("primary_mood")
-                if not p_mood and entry.get("moods"): p_mood = entry["moods"][0]
-                s_moods = entry.get("secondary_moods", [])
-                if not s_moods and entry.get("moods"): s_moods = entry["moods"][1:]
-                note = entry.get("note", "")
-                meds = entry.get("meds", [])
-                
-                p_emo = MedicalEngine.EMOJI_MAP.get(p_mood, "😶") if p_mood and p_mood!="无" else "😶"
-                s_emo_str = "".join([MedicalEngine.EMOJI_MAP.get(m, "") for m in s_moods])
-                meds_str = " ".join([f"<span style='font-size:0.8em; background:#eee; padding:2px 5px; border-radius:4px;'>{m}</span>" for m in meds])
-                d_fmt = datetime.strptime(d_str, "%Y-%m-%d").strftime("%m.%d")
-                st.markdown(f"""
-                <div class="timeline-entry">
-                    <div class="timeline-date">{d_fmt}</div>
-                    <div class="timeline-mood-big">{p_emo}</div>
-                    <div class="timeline-details">
-                        <div class="timeline-sub-moods">{s_emo_str} {meds_str}</div>
-                        <div class="timeline-note">{note if note else "无备注"}</div>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+            st.markdown(DiaryTimeline.render(c_data["logs"], keys), unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
+        if keys and not q.strip() and index.page(before=keys[-1], limit=1)[0]:
+            if st.button("加载更多", key="diary_more", use_container_width=True):
+                st.session_state.diary_until = index.page(before=keys[-1], limit=DiaryTimeline.PAGE_SIZE)[0][-1]
+                st.rerun()
+    Profiler.lap("ui.diary")
+
+    if Profiler.enabled(): Profiler.render_panel({"UserCache": cache.stats(), "CalendarCache": CalendarCache.stats()})
 
 def main():
+    Profiler.start_run("app")
+    try: render_page()
+    finally: Profiler.remember(Profiler.end_run())
+
+def render_page():
     st.set_page_config(page_title="CycleHealth V10.6", page_icon="🌺", layout="wide")
     if 'logged_in' not in st.session_state: st.session_state.logged_in = False
     
@@ -580,13 +2356,15 @@ def main():
         with c1:
             st.markdown('<div class="create-btn">', unsafe_allow_html=True)
             if st.button("创建账号"):
-                if AuthSystem.register(u,p): st.success("成功")
+                with st.spinner(""): ok = AuthSystem.register(u,p)
+                if ok: st.success("成功")
                 else: st.error("已存在")
             st.markdown('</div>', unsafe_allow_html=True)
         with c2:
             st.markdown('<div class="login-btn">', unsafe_allow_html=True)
             if st.button("登录"):
-                if AuthSystem.login(u,p): st.session_state.logged_in=True; st.session_state.username=u; st.rerun()
+                with st.spinner(""): ok = AuthSystem.login(u,p)
+                if ok: st.session_state.logged_in=True; st.session_state.username=u; st.rerun()
                 else: st.error("错误")
             st.markdown('</div>', unsafe_allow_html=True)
             
@@ -0,0 +1,71 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from main import DataManager, DailySnapshot, CyclePredictor, AnalyticsEngine, VersionConflict, JournaledBackend, RemoteBackend, StorageError
+
+# ==========================================
+# 🌙 后台预计算: 跨天后为全部用户重算阶段/预测/报告摘要, 写入记录的 daily 字段
+# ==========================================
+BATCH = 500
+
+def refresh_user(backend, username, meta, prediction, today):
+    # 比较并交换写回; 期间用户刚好保存过的话, 写入路径已经刷新了快照, 直接跳过
+    if AnalyticsEngine.needs_rebuild(meta): meta = backend.get_user(username)
+    base = meta.get("rev", 0)
+    meta["prediction"] = prediction
+    meta["rev"] = base + 1
+    DailySnapshot.refresh(meta, today)
+    try: backend.save_meta(username, meta, base); return True
+    except VersionConflict: return False
+
+def run_once(backend, today=None, threads=4, force=False):
+    # 只处理快照过期 (不是今天或 rev 对不上) 的用户; 预测按批次矩阵计算
+    today = today or date.today()
+    # 快照/预测都是派生数据: 绕过变更日志直接写存储, 否则每天每个用户都会多一条只有 rev 变化的记录
+    # 远程后端经数据服务写入, 服务端的变更日志绕不过去, 所以 worker 只能直接访问存储
+    if isinstance(backend, RemoteBackend): raise StorageError("worker 需要直接访问存储, 不支持 remote 后端: 请在数据服务所在机器上用 --backend sqlite/json 运行")
+    if isinstance(backend, JournaledBackend): backend = backend.backend
+    stale = [(u, m) for u, m in backend.iter_meta() if force or not DailySnapshot.is_fresh(m, today)]
+    done = 0
+    with ThreadPoolExecutor(threads) as pool:
+        for i in range(0, len(stale), BATCH):
+            chunk = stale[i:i + BATCH]
+            res = CyclePredictor.predict_batch([m["cycle_data"].get("dates", []) for _, m in chunk])
+            futures = [pool.submit(refresh_user, backend, u, m, CyclePredictor.to_record(res, j), today) for j, (u, m) in enumerate(chunk)]
+            done += sum(f.result() for f in futures)
+    return len(stale), done
+
+def run_forever(backend, interval=60, threads=4):
+    # 每隔 interval 秒检查一次: 跨天或存储有变化 (其他工具写入) 时补算过期用户
+    last_day = last_token = None
+    while True:
+        today, token = date.today(), backend.version_token()
+        if today != last_day or token != last_token:
+            t = time.perf_counter()
+            n, done = run_once(backend, today, threads)
+            if n: print(f"[{datetime.now():%H:%M:%S}] 刷新 {done}/{n} 个用户, {time.perf_counter() - t:.2f}s", flush=True)
+            last_day, last_token = today, backend.version_token()
+        # 顺带做定期快照: 变更日志攒够 SNAPSHOT_EVERY 条后压缩成快照并清理旧段
+        if isinstance(backend, JournaledBackend) and backend.journal.maybe_snapshot(backend.backend) is not None:
+            print(f"[{datetime.now():%H:%M:%S}] 已写入快照", flush=True)
+        time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleHealth 每日预计算 (阶段/预测/报告摘要)")
+    parser.add_argument("--backend", choices=["sqlite", "json"], help="默认取 CYCLE_STORAGE")
+    parser.add_argument("--once", action="store_true", help="只跑一次 (适合 cron)")
+    parser.add_argument("--force", action="store_true", help="忽略快照是否过期, 全部重算")
+    parser.add_argument("--interval", type=int, default=60)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+    backend = DataManager.create_backend(args.backend)
+    if isinstance(backend, RemoteBackend): parser.error("CYCLE_STORAGE=remote 时请用 --backend sqlite/json 指定数据服务使用的存储")
+    DataManager.use(backend)
+    if args.once or args.force:
+        n, done = run_once(backend, threads=args.threads, force=args.force)
+        print(f"刷新 {done}/{n} 个用户")
+    else: run_forever(backend, args.interval, args.threads)
+
+if __name__ == "__main__":
+    main()